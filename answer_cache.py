@@ -0,0 +1,202 @@
+# answer_cache.py
+"""
+Caché local de respuestas para la primera pregunta de una conversación.
+
+Muchas sesiones abren con casi la misma pregunta; con el caché activado (opt-in con
+SOFIA_ANSWER_CACHE=1) esas respuestas se sirven sin llamar al modelo. Solo se usa cuando
+la pregunta es el primer turno del usuario, sin historial ni resumen, así la respuesta no
+depende de nada más que del tema y sus instrucciones.
+
+El saludo pide al usuario que se presente, así que muchos primeros turnos traen nombres,
+empresas o correos y la respuesta los repite ("¡Hola Martín!"). Esos turnos no se guardan
+ni se sirven desde el caché (`is_personal`): la respuesta de un usuario no puede llegarle
+a otro.
+
+La clave es (tema, versión de las instrucciones, pregunta normalizada) y por defecto solo
+se usa la coincidencia exacta. Con SOFIA_ANSWER_CACHE_SIMILARITY (por ejemplo 0.9) también
+se acepta la pregunta guardada más parecida (coseno sobre las palabras, sin tildes ni
+palabras vacías). Las entradas vencen por TTL, se desalojan por LRU y se descartan solas
+cuando cambia el archivo de instrucciones.
+"""
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter, OrderedDict
+from knowledge_base import TOKEN_PATTERN, STOPWORDS, normalize_text, instructions_version
+
+ANSWER_CACHE_CONFIG = {
+    "enabled": os.environ.get("SOFIA_ANSWER_CACHE") == "1",
+    # Coseno mínimo entre preguntas para reutilizar la respuesta; 0 = solo coincidencia exacta
+    "similarity_threshold": float(os.environ.get("SOFIA_ANSWER_CACHE_SIMILARITY", "0")),
+    "ttl_seconds": 24 * 3600,
+    "max_entries": 500,
+    "min_answer_chars": 40,        # No guardar respuestas vacías o cortadas
+}
+
+# Palabras vacías que igual cambian el sentido de la pregunta
+MEANINGFUL_STOPWORDS = frozenset({"no", "sin", "mas", "contra"})
+
+# Datos personales en la pregunta (sobre el texto normalizado, salvo los nombres propios)
+SELF_INTRODUCTION = re.compile(r"\b(soy|somos|me llamo|nos llamamos|mi nombre|les? habla|te escribe|"
+                               r"les escribe|mi empresa|nuestra empresa|mi emprendimiento|mi pyme)\b")
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+PHONE = re.compile(r"\d(?:[\s-]?\d){6,}")
+SENTENCE_BREAK = re.compile(r"[.!?¿¡:;\n]+")
+WORD = re.compile(r"[^\W\d_]+")
+
+
+def question_terms(question):
+    return [token for token in TOKEN_PATTERN.findall(normalize_text(question))
+            if token not in STOPWORDS or token in MEANINGFUL_STOPWORDS]
+
+def normalize_question(question):
+    return " ".join(question_terms(question))
+
+def cosine(a, b):
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    if not dot:
+        return 0.0
+    norm_a = math.sqrt(sum(count * count for count in a.values()))
+    norm_b = math.sqrt(sum(count * count for count in b.values()))
+    return dot / (norm_a * norm_b)
+
+def has_proper_name(text):
+    """True si alguna palabra con mayúscula inicial no abre la oración (nombres, apellidos, empresas)."""
+    for sentence in SENTENCE_BREAK.split(text):
+        words = WORD.findall(sentence)
+        if any(word[0].isupper() for word in words[1:]):
+            return True
+    return False
+
+def is_personal(question):
+    """True si la pregunta trae una presentación, un nombre propio, un correo o un teléfono."""
+    return bool(SELF_INTRODUCTION.search(normalize_text(question)) or EMAIL.search(question)
+                or PHONE.search(question) or has_proper_name(question))
+
+def is_first_turn(messages, summary=None):
+    """True si el último mensaje es la primera pregunta del usuario y no hay resumen previo."""
+    if summary or not messages or messages[-1]["role"] != "user":
+        return False
+    return sum(1 for msg in messages if msg["role"] == "user") == 1
+
+def is_cacheable_turn(messages, summary=None):
+    """Primera pregunta del usuario y sin datos personales."""
+    return is_first_turn(messages, summary) and not is_personal(messages[-1]["content"])
+
+
+class AnswerCache:
+    """Caché LRU con TTL, consultable por clave exacta o por similitud dentro del mismo tema y versión."""
+
+    def __init__(self, max_entries, ttl_seconds, similarity_threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (tema, versión, pregunta normalizada) -> entrada
+        self.counters = Counter()
+
+    def _expired(self, entry, now):
+        return now - entry["stored_at"] > self.ttl_seconds
+
+    def get(self, topic, version, question, current_version=None):
+        """
+        Devuelve la respuesta guardada o None, y actualiza los contadores. Se descartan las
+        entradas de versiones distintas de `current_version` (la vigente; por defecto `version`).
+        """
+        current_version = current_version or version
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        now = time.time()
+        with self._lock:
+            key = (topic, version, normalized)
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["exact_hits"] += 1
+                return entry["answer"]
+            terms = Counter(normalized.split())
+            best_key, best_score = None, 0.0
+            for candidate_key, candidate in list(self._entries.items()):
+                if self._expired(candidate, now):
+                    del self._entries[candidate_key]
+                    self.counters["expired"] += 1
+                    continue
+                if candidate_key[0] != topic:
+                    continue
+                if candidate_key[1] not in (version, current_version):
+                    # Las instrucciones cambiaron desde que se guardó
+                    del self._entries[candidate_key]
+                    self.counters["invalidated"] += 1
+                    continue
+                if candidate_key[1] != version or not self.similarity_threshold:
+                    continue  # Sesión fijada a otra versión, o solo coincidencia exacta
+                score = cosine(terms, candidate["terms"])
+                if score > best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self.counters["hits"] += 1
+                self.counters["similar_hits"] += 1
+                return self._entries[best_key]["answer"]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, topic, version, question, answer):
+        normalized = normalize_question(question)
+        if not normalized or len(answer.strip()) < ANSWER_CACHE_CONFIG["min_answer_chars"]:
+            return
+        with self._lock:
+            key = (topic, version, normalized)
+            self._entries[key] = {"answer": answer, "terms": Counter(normalized.split()), "stored_at": time.time()}
+            self._entries.move_to_end(key)
+            self.counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    def count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries))
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        stats["hit_rate"] = (stats.get("hits", 0) / lookups) if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Caché de respuestas compartido por el proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(ANSWER_CACHE_CONFIG["max_entries"], ANSWER_CACHE_CONFIG["ttl_seconds"],
+                                 ANSWER_CACHE_CONFIG["similarity_threshold"])
+        return _cache
+
+def lookup(topic, messages, summary=None, version=None):
+    """
+    Respuesta guardada para este turno, o None si el caché está apagado o el turno no aplica.
+    `version`: la de las instrucciones fijadas en la sesión (por defecto, la vigente).
+    """
+    if not ANSWER_CACHE_CONFIG["enabled"] or not is_first_turn(messages, summary):
+        return None
+    if is_personal(messages[-1]["content"]):
+        get_cache().count("personal")
+        return None
+    current_version = instructions_version(topic)
+    return get_cache().get(topic, version or current_version, messages[-1]["content"], current_version)
+
+def store(topic, messages, answer, summary=None, version=None):
+    """Guarda la respuesta del modelo si el turno era cacheable. `messages` no incluye la respuesta."""
+    if not ANSWER_CACHE_CONFIG["enabled"] or not is_cacheable_turn(messages, summary):
+        return
+    get_cache().put(topic, version or instructions_version(topic), messages[-1]["content"], answer)
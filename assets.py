@@ -0,0 +1,88 @@
+# assets.py
+"""
+Variantes livianas de las imágenes de logos/ para la app.
+
+Los originales miden hasta 5083 px de ancho y 280 KB, pero se muestran a menos de 600 px.
+`build_variants` genera en logos/optimized/ versiones reducidas (WebP para los logos del
+encabezado, PNG chico para avatares e ícono). `variant_path` devuelve la variante si ya
+existe y si no el original, así la app funciona igual antes del primer build.
+
+Uso (paso de build, también lo corre la app en segundo plano si faltan variantes):
+    python assets.py            # genera las variantes que faltan o quedaron viejas
+    python assets.py --force    # regenera todas
+"""
+import os
+import argparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGOS_DIR = os.path.join(SCRIPT_DIR, "logos")
+OPTIMIZED_DIR = os.path.join(LOGOS_DIR, "optimized")
+
+# Original -> {variante: (ancho máximo en px, formato)}. Los anchos duplican el tamaño en
+# pantalla para pantallas de alta densidad.
+ASSET_VARIANTS = {
+    "ICOMEX_Logos sin fondo.png": {"header": (1200, "WEBP")},
+    "SofIA sin fondo.png": {"header": (300, "WEBP")},
+    "sofia_avatar.png": {"avatar": (96, "PNG"), "icon": (64, "PNG")},
+    "user_avatar.png": {"avatar": (96, "PNG")},
+}
+
+SAVE_OPTIONS = {
+    "WEBP": {"quality": 85, "method": 6},
+    "PNG": {"optimize": True},
+}
+
+
+def output_path(name, variant):
+    width, image_format = ASSET_VARIANTS[name][variant]
+    base = os.path.splitext(name)[0]
+    return os.path.join(OPTIMIZED_DIR, f"{base}_{variant}.{image_format.lower()}")
+
+def variant_path(path, variant):
+    """Ruta de la variante de `path` (ruta relativa u absoluta de logos/), o `path` si no hay."""
+    name = os.path.basename(path)
+    if variant not in ASSET_VARIANTS.get(name, {}):
+        return path
+    optimized = output_path(name, variant)
+    return optimized if os.path.exists(optimized) else path
+
+def is_stale(source, target):
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)
+
+def build_variants(force=False):
+    """Genera las variantes que faltan o son más viejas que el original. Devuelve las rutas escritas."""
+    written = []
+    for name, variants in ASSET_VARIANTS.items():
+        source = os.path.join(LOGOS_DIR, name)
+        if not os.path.exists(source):
+            print(f"DEBUG: No se encontró {source}")
+            continue
+        pending = {variant: spec for variant, spec in variants.items()
+                   if force or is_stale(source, output_path(name, variant))}
+        if not pending:
+            continue
+        from PIL import Image  # Solo si hay algo que generar; con las variantes al día la app no carga PIL
+        os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+        with Image.open(source) as original:
+            image = original.convert("RGBA")
+        for variant, (width, image_format) in pending.items():
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)  # Mantiene la proporción
+            target = output_path(name, variant)
+            temp_path = f"{target}.tmp"
+            resized.save(temp_path, format=image_format, **SAVE_OPTIONS[image_format])
+            os.replace(temp_path, target)
+            written.append(target)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera las variantes livianas de logos/.")
+    parser.add_argument("--force", action="store_true", help="Regenera aunque estén al día")
+    args = parser.parse_args()
+    for path in build_variants(args.force):
+        print(f"{os.path.relpath(path, SCRIPT_DIR)}: {os.path.getsize(path) / 1024:.1f} KB")
+    print("Variantes al día.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# bench_cold_start.py
+"""
+Perfil de arranque en frío: tiempo de importar los módulos de la app y de dibujar la primera
+página (introducción, sin tema elegido), cada uno en un proceso nuevo.
+
+Además verifica que la primera página no cargue los módulos pesados que solo hacen falta más
+adelante (SDKs de OpenAI y ElevenLabs, pymongo, xhtml2pdf, emoji, PIL...). Sale con código 1
+si se pasa del presupuesto o si aparece alguno.
+
+Uso:
+    python bench_cold_start.py
+    python bench_cold_start.py --runs 5 --import-budget-ms 400 --render-budget-ms 2000
+    python bench_cold_start.py --profile     # los 15 imports más lentos (python -X importtime)
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Módulos que importa streamlit_app.py (sin contar streamlit)
+APP_MODULES = ["frontend", "sidebar", "knowledge_base", "chat_requests", "conversation_history", "clients",
+               "persistence", "pdf_export", "mongo_indexes", "answer_cache", "upstream", "metrics", "tts",
+               "assets"]
+
+# No deberían cargarse antes de que el usuario elija un tema, active el audio o pida el PDF
+HEAVY_MODULES = ["openai", "elevenlabs", "pymongo", "gridfs", "bson", "xhtml2pdf", "reportlab", "emoji",
+                 "certifi", "PIL", "pyarrow"]
+
+# Se comparan contra los módulos ya cargados al iniciar el intérprete (algunos entornos
+# cargan certifi desde un .pth de site-packages)
+IMPORT_PROBE = """
+import sys, time, json
+preloaded = set(sys.modules)
+import streamlit
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules and m not in preloaded]}}))
+"""
+
+RENDER_PROBE = """
+import sys, time, json
+preloaded = set(sys.modules)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=60)
+start = time.perf_counter()
+at.run()
+elapsed = time.perf_counter() - start
+error = str(at.exception[0].value) if at.exception else None
+print(json.dumps({{"seconds": elapsed, "error": error, "loaded": [m for m in {heavy!r} if m in sys.modules and m not in preloaded]}}))
+"""
+
+
+def run_probe(code):
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR, capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode or not lines:
+        raise RuntimeError(f"La medición falló:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+def import_profile(top):
+    """Los `top` módulos con mayor tiempo acumulado según python -X importtime."""
+    code = "import streamlit\n" + "\n".join(f"import {name}" for name in APP_MODULES)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SCRIPT_DIR,
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+def measure(code, runs):
+    samples, loaded, errors = [], set(), []
+    for _ in range(runs):
+        probe = run_probe(code)
+        samples.append(probe["seconds"])
+        loaded.update(probe["loaded"])
+        if probe.get("error"):
+            errors.append(probe["error"])
+    return statistics.median(samples), sorted(loaded), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío de SofIA.")
+    parser.add_argument("--runs", type=int, default=3, help="Procesos nuevos por medición")
+    parser.add_argument("--import-budget-ms", type=float, default=300.0,
+                        help="Tope para importar los módulos de la app (sin streamlit)")
+    parser.add_argument("--render-budget-ms", type=float, default=1500.0,
+                        help="Tope para dibujar la primera página")
+    parser.add_argument("--profile", action="store_true", help="Muestra los imports más lentos")
+    args = parser.parse_args()
+
+    failures = []
+    import_time, import_loaded, _ = measure(IMPORT_PROBE.format(modules=APP_MODULES, heavy=HEAVY_MODULES), args.runs)
+    print(f"Import de los módulos de la app: {import_time * 1000:.0f} ms (presupuesto {args.import_budget_ms:.0f} ms)")
+    if import_time * 1000 > args.import_budget_ms:
+        failures.append("import fuera de presupuesto")
+    if import_loaded:
+        failures.append(f"módulos pesados cargados al importar: {', '.join(import_loaded)}")
+
+    render_time, render_loaded, errors = measure(
+        RENDER_PROBE.format(app=os.path.join(SCRIPT_DIR, "streamlit_app.py"), heavy=HEAVY_MODULES), args.runs)
+    print(f"Primera página: {render_time * 1000:.0f} ms (presupuesto {args.render_budget_ms:.0f} ms)")
+    if render_time * 1000 > args.render_budget_ms:
+        failures.append("primera página fuera de presupuesto")
+    if render_loaded:
+        failures.append(f"módulos pesados cargados en la primera página: {', '.join(render_loaded)}")
+    if errors:
+        failures.append(f"la primera página lanzó una excepción: {errors[0]}")
+
+    if args.profile:
+        print("\nImports más lentos (acumulado, propio, módulo):")
+        for cumulative_us, self_us, name in import_profile(15):
+            print(f"  {cumulative_us / 1000:8.1f} ms {self_us / 1000:8.1f} ms  {name}")
+
+    for failure in failures:
+        print(f"FALLA: {failure}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench_history_render.py
+"""
+Benchmark del tiempo de rerun según el largo de la conversación.
+
+Arma sesiones de AppTest con 5 a 200 turnos ya mostrados y mide reruns sin mensajes nuevos
+(lo que pasa al abrir el formulario, activar el audio o pedir otra página). Con el historial
+paginado el tiempo debería quedar plano; con --all se dibujan todas las burbujas, como antes.
+
+Uso:
+    python bench_history_render.py
+    python bench_history_render.py --turns 5 50 200 --runs 10
+    python bench_history_render.py --check --max-ratio 1.5   # sale con código 1 si no es plano
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import frontend
+from conversation_history import ChatMessage
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+TOPIC = "¡Quiero exportar!"
+
+USER_TEXT = "¿Qué requisitos necesito para exportar miel a la Unión Europea y cuánto demora el trámite?"
+ASSISTANT_TEXT = ("Para exportar miel a la **Unión Europea** necesitás:\n\n"
+                  "1. Inscripción en el registro de exportadores.\n"
+                  "2. Habilitación sanitaria del establecimiento.\n"
+                  "3. Certificado de origen y análisis de residuos.\n\n"
+                  "El trámite suele demorar entre 30 y 60 días. Escribinos a agencia@icomexlapampa.org 😊")
+
+
+def conversation(turns):
+    messages = [ChatMessage("assistant", frontend.GREETINGS[TOPIC])]
+    for _ in range(turns):
+        messages.append(ChatMessage("user", USER_TEXT))
+        messages.append(ChatMessage("assistant", ASSISTANT_TEXT))
+    return messages
+
+def measure(turns, runs, timeout):
+    """Mediana y p90 (segundos) de `runs` reruns de una sesión con `turns` turnos."""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    messages = conversation(turns)
+    at.session_state["selected_topic"] = TOPIC
+    at.session_state["initial_message"] = frontend.GREETINGS[TOPIC]
+    at.session_state["initial_message_shown"] = True
+    at.session_state["subtitle_shown"] = True
+    at.session_state["messages"] = messages
+    at.session_state["rendered_count"] = len(messages)
+    at.run()  # Calentamiento: imports, índices y cachés del proceso
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.9 * (len(samples) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de rerun según el largo del historial.")
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 25, 50, 100, 200])
+    parser.add_argument("--runs", type=int, default=20, help="Reruns medidos por largo")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--all", action="store_true", help="Dibujar todas las burbujas (sin paginar)")
+    parser.add_argument("--check", action="store_true", help="Falla si el tiempo no se mantiene plano")
+    parser.add_argument("--max-ratio", type=float, default=1.5,
+                        help="Cociente máximo entre la mediana del mayor y del menor largo")
+    args = parser.parse_args()
+
+    if args.all:
+        frontend.CHAT_VIEW_CONFIG["visible_messages"] = sys.maxsize // 2
+    results = {}
+    print(f"{'turnos':>7} {'mediana ms':>11} {'p90 ms':>9}")
+    for turns in args.turns:
+        median, p90 = measure(turns, args.runs, args.timeout)
+        results[turns] = median
+        print(f"{turns:>7} {median * 1000:>11.1f} {p90 * 1000:>9.1f}")
+
+    ratio = results[max(results)] / results[min(results)]
+    print(f"Cociente {max(results)}/{min(results)} turnos: {ratio:.2f}")
+    if args.check and ratio > args.max_ratio:
+        print(f"El tiempo de rerun crece con el historial (máximo permitido {args.max_ratio})")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
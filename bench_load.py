@@ -0,0 +1,346 @@
+# bench_load.py
+"""
+Prueba de carga de la app con servidores locales en lugar de OpenAI, ElevenLabs y MongoDB.
+
+Levanta un servidor HTTP falso que imita /v1/chat/completions (con streaming SSE) y
+/v1/text-to-speech/<voz>, con latencia configurable, y usa mongomock (o un mongod local
+con --mongo-uri). Cada usuario simulado es un AppTest de Streamlit que elige un tema con
+los botones de la introducción (select_export / select_investment) y envía un guion de
+preguntas. Informa latencia por turno (p50/p95/p99), tiempo al primer token según la app,
+turnos por segundo y memoria retenida por sesión.
+
+Uso:
+    python bench_load.py --users 20 --turns 4
+    python bench_load.py --users 50 --ttft 0.8 --chunk-delay 0.02 --audio-ratio 0.3
+    python bench_load.py --json resultado.json --baseline base.json --max-regression 20
+    SOFIA_PREFETCH=0 python bench_load.py --json sin_prefetch.json   # primer turno sin precalentar
+
+Requiere streamlit (AppTest) y mongomock (pip install mongomock) si no se usa --mongo-uri.
+El journal del auto-guardado y el caché de audio van a un directorio temporal, así la prueba
+no toca los archivos de la app. Con --mongo-uri el mongod local se usa sin TLS.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+
+PROMPT_SCRIPTS = {
+    "intro_comercio": [
+        "Hola, me llamo Ana y quiero exportar miel a Europa.",
+        "¿Qué necesito para inscribirme como exportadora?",
+        "¿Hay algún programa de financiamiento para la primera exportación?",
+        "¿Dónde queda la agencia y en qué horario atienden?",
+        "Gracias, ¿me pueden contactar por correo?",
+    ],
+    "intro_inversiones": [
+        "Hola, soy Juan y me interesa invertir en La Pampa.",
+        "¿Qué incentivos fiscales hay para nuevas industrias?",
+        "¿Cuáles son los parques industriales disponibles?",
+        "¿Cómo es la logística hacia el puerto de Bahía Blanca?",
+        "Gracias, ¿con quién hablo para avanzar?",
+    ],
+}
+
+FAKE_ANSWER = ("Para exportar necesitás inscribirte en el registro de exportadores, contar con la "
+               "clave fiscal y definir la posición arancelaria del producto. Desde la agencia te "
+               "acompañamos en cada paso: capacitación, ferias internacionales y búsqueda de "
+               "compradores. Podés escribirnos a agencia@icomexlapampa.org o llamar al 2954575326. ")
+
+# Un MP3 mínimo (un frame vacío) repetido: alcanza para que st.audio lo acepte
+FAKE_MP3_FRAME = bytes.fromhex("fffb9064") + bytes(413)
+
+
+# --- Servidores falsos ---
+
+class FakeUpstream:
+    """Servidor HTTP local con las rutas de OpenAI y ElevenLabs que usa la app."""
+
+    def __init__(self, ttft, chunk_delay, words, tts_latency, error_rate):
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.words = words
+        self.tts_latency = tts_latency
+        self.error_rate = error_rate
+        self.requests = {"chat": 0, "tts": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-upstream", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _count(self, key):
+        with self._lock:
+            self.requests[key] += 1
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                # GET /v1/models/<modelo>: lo usa prefetch.py para abrir la conexión
+                if "/models/" in self.path:
+                    self._send_json(200, {"id": self.path.rsplit("/", 1)[-1], "object": "model",
+                                          "created": 0, "owned_by": "bench"})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if random.random() < upstream.error_rate:
+                    upstream._count("errors")
+                    self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}})
+                    return
+                if self.path.endswith("/chat/completions"):
+                    upstream._count("chat")
+                    self._chat(request)
+                elif "/text-to-speech/" in self.path:
+                    upstream._count("tts")
+                    self._tts()
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def _chat(self, request):
+                words = (FAKE_ANSWER * 10).split(" ")[:upstream.words]
+                time.sleep(upstream.ttft)
+                usage = {"prompt_tokens": 1200, "completion_tokens": len(words),
+                         "total_tokens": 1200 + len(words), "prompt_tokens_details": {"cached_tokens": 1024}}
+                base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": request.get("model", "gpt-4o-mini")}
+                if not request.get("stream"):
+                    self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": " ".join(words)}}]))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send_event(payload):
+                    data = f"data: {payload}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+
+                for i, word in enumerate(words):
+                    delta = {"content": word + " "} if i else {"role": "assistant", "content": word + " "}
+                    send_event(json.dumps(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])))
+                    time.sleep(upstream.chunk_delay)
+                send_event(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+                send_event(json.dumps(dict(base, choices=[], usage=usage)))
+                send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _tts(self):
+                time.sleep(upstream.tts_latency)
+                body = FAKE_MP3_FRAME * 20
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+# --- Usuarios simulados ---
+
+def app_secrets(upstream, mongo_uri):
+    return {
+        "openai": {"api_key": "bench", "base_url": f"{upstream.base_url}/v1"},
+        "elevenlabs": {"api_key": "bench", "base_url": upstream.base_url},
+        "mongodb": {"uri": mongo_uri or "mongodb://localhost:27017", "db_name": "sofia_bench",
+                    "collection_name": "conversations", "pdf_metadata_collection": "pdf_metadata",
+                    "gridfs_prefix": "pdfs", "tls": False},
+    }
+
+def isolate_files():
+    """Journal y caché de audio en un directorio temporal (antes de importar los módulos de la app)."""
+    directory = tempfile.mkdtemp(prefix="sofia_bench_")
+    os.environ["SOFIA_AUTOSAVE_JOURNAL"] = os.path.join(directory, "autosave_journal.jsonl")
+    os.environ["SOFIA_TTS_CACHE_DIR"] = os.path.join(directory, "tts_cache")
+    return directory
+
+def patch_mongomock_bulk():
+    """
+    pymongo 4.9+ pasa `sort` a add_update/add_replace dentro de bulk_write y mongomock todavía
+    no lo acepta. La app nunca usa sort en UpdateOne; si llegara uno, se falla en lugar de ignorarlo.
+    """
+    import inspect
+    from mongomock.collection import BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        original = getattr(BulkOperationBuilder, name)
+        if "sort" in inspect.signature(original).parameters:
+            continue
+        def accept_sort(self, *args, _original=original, sort=None, **kwargs):
+            if sort is not None:
+                raise NotImplementedError("mongomock no soporta sort en bulk_write")
+            return _original(self, *args, **kwargs)
+        setattr(BulkOperationBuilder, name, accept_sort)
+
+def use_mongomock():
+    """Registra un cliente mongomock en el registro de clientes del proceso (lo comparte la app)."""
+    import mongomock
+    import clients
+    patch_mongomock_bulk()
+    with clients._lock:
+        clients._clients["mongo"] = mongomock.MongoClient()
+
+def run_user(user_id, args, secrets):
+    """Corre una sesión completa y devuelve sus mediciones."""
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(user_id)
+    topic_button = rng.choice(list(PROMPT_SCRIPTS))
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    for section, values in secrets.items():
+        at.secrets[section] = values
+    result = {"user": user_id, "topic": topic_button, "turns": [], "errors": []}
+
+    at.run()
+    if rng.random() < args.audio_ratio:
+        at.session_state["audio_enabled"] = True
+    at.button(key=topic_button).click().run()
+    for prompt in PROMPT_SCRIPTS[topic_button][:args.turns]:
+        time.sleep(rng.uniform(0, args.think_time))
+        start = time.perf_counter()
+        at.chat_input[0].set_value(prompt).run()
+        result["turns"].append(time.perf_counter() - start)
+        if at.exception:
+            result["errors"].append(str(at.exception[0].value))
+    timings = at.session_state["turn_timings"] if "turn_timings" in at.session_state else []
+    result["ttft"] = [t["ttft"] for t in timings if t.get("ttft") is not None]
+    result["first_turn_ttft"] = [t["first_turn_ttft"] for t in timings if t.get("first_turn_ttft") is not None]
+    result["prefetch"] = [t["prefetch"] for t in timings if t.get("prefetch")]
+    result["app"] = at  # Se conserva para medir la memoria retenida por sesión
+    return result
+
+
+# --- Reporte ---
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def summarize(results, wall_time, memory_bytes, upstream):
+    turns = [t for r in results for t in r["turns"]]
+    ttfts = [t for r in results for t in r["ttft"]]
+    first_turns = [t for r in results for t in r["first_turn_ttft"]]
+    return {
+        "users": len(results),
+        "turns": len(turns),
+        "errors": sum(len(r["errors"]) for r in results),
+        "wall_time_s": round(wall_time, 3),
+        "throughput_turns_per_s": round(len(turns) / wall_time, 3) if wall_time else None,
+        "turn_p50_s": percentile(turns, 0.5), "turn_p95_s": percentile(turns, 0.95),
+        "turn_p99_s": percentile(turns, 0.99),
+        "turn_mean_s": statistics.mean(turns) if turns else None,
+        "ttft_p50_s": percentile(ttfts, 0.5), "ttft_p99_s": percentile(ttfts, 0.99),
+        "first_turn_ttft_p50_s": percentile(first_turns, 0.5), "first_turn_ttft_p99_s": percentile(first_turns, 0.99),
+        "prefetch_states": dict(Counter(state for r in results for state in r["prefetch"])),
+        "memory_per_session_kb": round(memory_bytes / len(results) / 1024, 1) if results else None,
+        "upstream_requests": dict(upstream.requests),
+    }
+
+def compare(summary, baseline, max_regression):
+    """Lista las métricas que empeoraron más que `max_regression` por ciento."""
+    regressions = []
+    for key in ("turn_p50_s", "turn_p99_s", "ttft_p99_s", "first_turn_ttft_p50_s", "memory_per_session_kb"):
+        old, new = baseline.get(key), summary.get(key)
+        if old and new and (new - old) / old * 100 > max_regression:
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f} (+{(new - old) / old * 100:.0f}%)")
+    old, new = baseline.get("throughput_turns_per_s"), summary.get("throughput_turns_per_s")
+    if old and new and (old - new) / old * 100 > max_regression:
+        regressions.append(f"throughput_turns_per_s: {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de SofIA con servidores locales.")
+    parser.add_argument("--users", type=int, default=10, help="Sesiones simultáneas")
+    parser.add_argument("--turns", type=int, default=3, help="Preguntas por sesión (máx. 5)")
+    parser.add_argument("--ttft", type=float, default=0.4, help="Segundos hasta el primer token")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Segundos entre fragmentos")
+    parser.add_argument("--words", type=int, default=120, help="Palabras por respuesta")
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--audio-ratio", type=float, default=0.0, help="Fracción de sesiones con audio")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 429")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Pausa máxima entre preguntas")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Tope por rerun de AppTest")
+    parser.add_argument("--mongo-uri", help="mongod local en lugar de mongomock")
+    parser.add_argument("--json", help="Guarda el resumen en este archivo")
+    parser.add_argument("--baseline", help="Resumen anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Porcentaje tolerado")
+    args = parser.parse_args()
+
+    print(f"Archivos temporales en {isolate_files()}")
+    upstream = FakeUpstream(args.ttft, args.chunk_delay, args.words, args.tts_latency, args.error_rate).start()
+    if not args.mongo_uri:
+        use_mongomock()
+    secrets = app_secrets(upstream, args.mongo_uri)
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        results = list(executor.map(lambda user_id: run_user(user_id, args, secrets), range(args.users)))
+    wall_time = time.perf_counter() - start
+    memory_bytes = max(0, tracemalloc.get_traced_memory()[0] - memory_before)
+    tracemalloc.stop()
+    upstream.stop()
+
+    summary = summarize(results, wall_time, memory_bytes, upstream)
+    for key, value in summary.items():
+        print(f"{key:26s} {value:.3f}" if isinstance(value, float) else f"{key:26s} {value}")
+    for result in results:
+        for error in result["errors"][:1]:
+            print(f"Error en la sesión {result['user']}: {error}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(summary, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            sys.exit(1)
+    if summary["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench_session_memory.py
+"""
+Memoria por sesión del estado de la conversación, con el formato anterior y el actual.
+
+Antes: cada mensaje era un dict, la sesión guardaba las instrucciones del tema como mensaje
+de sistema (una copia leída del archivo por sesión cuando la recuperación está apagada) y un
+set con los ids de los mensajes ya mostrados. Ahora: registros ChatMessage con __slots__,
+las instrucciones se comparten en el proceso (la sesión guarda solo su versión) y un contador.
+
+Uso:
+    python bench_session_memory.py
+    python bench_session_memory.py --sessions 500 --turns 20
+"""
+import gc
+import argparse
+import tracemalloc
+import knowledge_base
+from conversation_history import ChatMessage
+
+TOPIC = "¡Quiero exportar!"
+
+
+def turn_texts(session, turn):
+    # Textos distintos por sesión, como en producción (no se comparten entre sesiones)
+    user = f"Sesión {session}, pregunta {turn}: ¿qué necesito para exportar miel a Europa?"
+    assistant = (f"Sesión {session}, respuesta {turn}: necesitás inscribirte como exportador, "
+                 "definir la posición arancelaria y tramitar el certificado sanitario. ") * 3
+    return user, assistant
+
+def legacy_session(session, turns, shared_text=None):
+    """Estado con el formato anterior. `shared_text`: parte fija del índice (recuperación activada)."""
+    instructions = shared_text if shared_text is not None else knowledge_base.read_instructions(TOPIC)
+    messages = [{"role": "system", "content": instructions},
+                {"role": "assistant", "content": f"¡Hola! Saludo de la sesión {session}"}]
+    for turn in range(turns):
+        user, assistant = turn_texts(session, turn)
+        messages.append({"role": "user", "content": user})
+        messages.append({"role": "assistant", "content": assistant})
+    rendered_ids = {f"{m['role']}-{i}" for i, m in enumerate(messages) if m["role"] != "system"}
+    return {"messages": messages, "rendered_message_ids": rendered_ids}
+
+def current_session(session, turns):
+    messages = [ChatMessage("assistant", f"¡Hola! Saludo de la sesión {session}")]
+    for turn in range(turns):
+        user, assistant = turn_texts(session, turn)
+        messages.append(ChatMessage("user", user))
+        messages.append(ChatMessage("assistant", assistant))
+    return {"messages": messages, "instructions_version": knowledge_base.instructions_version(TOPIC),
+            "rendered_count": len(messages)}
+
+def bytes_per_session(factory, sessions, turns):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [factory(session, turns) for session in range(sessions)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del states
+    return (after - before) / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por sesión del estado de la conversación.")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+
+    knowledge_base.shared_instructions(TOPIC)  # La copia del proceso se carga una sola vez
+    fixed_text = knowledge_base.split_instructions(knowledge_base.read_instructions(TOPIC))[0]
+    rows = [
+        ("antes, sin recuperación", lambda s, t: legacy_session(s, t)),
+        ("antes, con recuperación", lambda s, t: legacy_session(s, t, fixed_text)),
+        ("ahora", current_session),
+    ]
+    print(f"{args.sessions} sesiones, {args.turns} turnos cada una")
+    results = {}
+    for label, factory in rows:
+        results[label] = bytes_per_session(factory, args.sessions, args.turns)
+        print(f"{label:26s} {results[label] / 1024:9.1f} KB por sesión")
+    for label in ("antes, sin recuperación", "antes, con recuperación"):
+        saved = results[label] - results["ahora"]
+        print(f"Ahorro respecto de '{label}': {saved / 1024:.1f} KB por sesión "
+              f"({saved * args.sessions / 1024 / 1024:.1f} MB con {args.sessions} sesiones)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench_text_normalizer.py
+"""
+Micro-benchmark del normalizador de texto contra las funciones anteriores de sidebar.py,
+y verificación de casos dorados (transcripciones reales en text_normalizer_golden.json).
+
+Uso:
+    python bench_text_normalizer.py               # benchmark + verificación
+    python bench_text_normalizer.py --check       # solo verificación (sale con código 1 si falla)
+    python bench_text_normalizer.py --update-golden
+"""
+import os
+import re
+import sys
+import json
+import timeit
+import argparse
+import emoji
+from text_normalizer import normalize_for_audio, normalize_for_pdf
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "text_normalizer_golden.json")
+
+
+# --- Implementaciones anteriores (referencia para el benchmark) ---
+
+def legacy_clean_message(message_content):
+    message_content = re.sub(r"\*\*(.*?)\*\*", r"\1", message_content)
+    message_content = emoji.replace_emoji(message_content, replace="")
+    message_content = message_content.replace("#", "")
+    message_content = message_content.replace("\n", "<br>")
+    return message_content
+
+def legacy_clean_message_for_audio(message_content):
+    message_content = message_content.replace("$2.000.000.000", "dos mil millones de pesos")
+    message_content = message_content.replace("$300.000.000", "trescientos millones de pesos")
+    message_content = message_content.replace("$3.000.000.000", "tres mil millones de pesos")
+    message_content = message_content.replace("I-COMEX", "ICÓMEX")
+    message_content = message_content.replace("km", "kilómetros")
+    message_content = message_content.replace("1950", "mil novecientos cincuenta")
+    message_content = message_content.replace("Pellegrini", "Pelegrini")
+    message_content = message_content.replace("2954575326", "dos nueve cinco cuatro, cincuenta y siete, cincuenta y tres, veintiseis.")
+    message_content = message_content.replace("agencia@icomexlapampa.org", "agencia, arroba, icomexlapampa, punto, org.")
+    message_content = message_content.replace("08:00 a 15:00 hs", "ocho a quince horas")
+    message_content = message_content.replace("https://maps.app.goo.gl/RET62U9mK9JecpmT9", "")
+    message_content = re.sub(r"\*\*(.*?)\*\*", r"\1", message_content)
+    message_content = emoji.replace_emoji(message_content, replace="")
+    message_content = message_content.replace("#", "")
+    message_content = message_content.replace(":", "")
+    message_content = message_content.replace("\n", ". ")
+    return message_content
+
+
+def load_golden():
+    with open(GOLDEN_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def check_golden(cases):
+    failures = 0
+    for case in cases:
+        for profile, normalize in (("audio", normalize_for_audio), ("pdf", normalize_for_pdf)):
+            actual = normalize(case["input"])
+            if actual != case[profile]:
+                failures += 1
+                print(f"FALLA [{case['name']} / {profile}]\n  esperado: {case[profile]!r}\n  obtenido: {actual!r}")
+    print(f"Casos dorados: {len(cases) * 2 - failures}/{len(cases) * 2} correctos.")
+    return failures == 0
+
+def update_golden(cases):
+    for case in cases:
+        case["audio"] = normalize_for_audio(case["input"])
+        case["pdf"] = normalize_for_pdf(case["input"])
+    with open(GOLDEN_PATH, "w", encoding="utf-8") as file:
+        json.dump(cases, file, ensure_ascii=False, indent=2)
+        file.write("\n")
+    print(f"Actualizados {len(cases)} casos en {GOLDEN_PATH}")
+
+def benchmark(cases, number):
+    texts = [case["input"] for case in cases]
+    normalize_for_audio(texts[0])  # Compilar los patrones fuera de la medición
+    normalize_for_pdf(texts[0])
+    pairs = [
+        ("audio", legacy_clean_message_for_audio, normalize_for_audio),
+        ("pdf", legacy_clean_message, normalize_for_pdf),
+    ]
+    for profile, legacy, current in pairs:
+        legacy_time = timeit.timeit(lambda: [legacy(t) for t in texts], number=number)
+        current_time = timeit.timeit(lambda: [current(t) for t in texts], number=number)
+        per_call = 1e6 / (number * len(texts))
+        print(f"{profile:5s}  anterior {legacy_time * per_call:8.1f} µs/texto   "
+              f"nuevo {current_time * per_call:8.1f} µs/texto   ({legacy_time / current_time:4.1f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark y casos dorados del normalizador de texto.")
+    parser.add_argument("--check", action="store_true", help="Solo verifica los casos dorados")
+    parser.add_argument("--update-golden", action="store_true", help="Regenera las salidas esperadas")
+    parser.add_argument("--number", type=int, default=200, help="Repeticiones del benchmark")
+    args = parser.parse_args()
+
+    cases = load_golden()
+    if args.update_golden:
+        update_golden(cases)
+        return
+    ok = check_golden(cases)
+    if not args.check:
+        benchmark(cases, args.number)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
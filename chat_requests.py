@@ -0,0 +1,137 @@
+# chat_requests.py
+"""
+Armado de las solicitudes a OpenAI y contabilidad de tokens por tema.
+
+El prefijo estático (instrucciones del tema) va siempre primero y sin modificaciones,
+para que sea idéntico byte a byte entre turnos y sesiones y aproveche el caché de prompts
+del proveedor. Lo que cambia por turno (conocimientos recuperados) va al final.
+"""
+import hashlib
+import threading
+
+# Configuración por tema
+TOPIC_CONFIG = {
+    "¡Quiero exportar!": {
+        "model": "gpt-4o-mini",
+        "temperature": 0.3,
+        "top_p": 0.1,
+        "frequency_penalty": -0.5,
+        "presence_penalty": -0.5,
+    },
+    "Oportunidades de Inversión": {
+        "model": "gpt-4o-mini",
+        "temperature": 0.3,
+        "top_p": 0.1,
+        "frequency_penalty": 0.2,
+        "presence_penalty": 0.2,
+    },
+    "default": {
+        "model": "gpt-4o-mini",
+        "temperature": 0.3,
+        "top_p": 0.1,
+        "frequency_penalty": 0.2,
+        "presence_penalty": 0.2,
+    }
+}
+
+# Precios en USD por millón de tokens
+MODEL_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+}
+
+SAMPLING_KEYS = ("temperature", "top_p", "frequency_penalty", "presence_penalty")
+
+_usage_lock = threading.Lock()
+_usage_by_topic = {}
+
+
+def get_topic_config(topic):
+    return TOPIC_CONFIG.get(topic, TOPIC_CONFIG["default"])
+
+def prefix_hash(instructions):
+    """Identificador corto del prefijo estático, para agrupar métricas de caché."""
+    return hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:12]
+
+def build_request(topic, history, instructions, context=None, summary=None, stream=True):
+    """
+    Arma los argumentos de chat.completions.create para un turno.
+
+    Orden de los mensajes: instrucciones del tema (prefijo fijo), resumen de los turnos
+    anteriores, historial reciente sin mensajes de sistema, conocimientos recuperados y,
+    por último, el mensaje actual del usuario.
+    """
+    config = get_topic_config(topic)
+    conversation = [{"role": m["role"], "content": m["content"]} for m in history if m["role"] != "system"]
+    messages = [{"role": "system", "content": instructions}]
+    if summary:
+        messages.append({"role": "system", "content": f"Resumen de la conversación hasta ahora:\n{summary}"})
+    messages.extend(conversation[:-1])
+    if context:
+        messages.append({"role": "system", "content": context})
+    messages.extend(conversation[-1:])
+
+    request = {"model": config["model"], "messages": messages}
+    request.update({key: config[key] for key in SAMPLING_KEYS})
+    if stream:
+        request["stream"] = True
+        request["stream_options"] = {"include_usage": True}
+    return request
+
+
+# --- Contabilidad de tokens ---
+
+def usage_cost(model, prompt_tokens, cached_tokens, completion_tokens):
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return None
+    uncached = prompt_tokens - cached_tokens
+    return (uncached * pricing["input"] + cached_tokens * pricing["cached_input"]
+            + completion_tokens * pricing["output"]) / 1_000_000
+
+def record_usage(topic, model, usage, instructions_hash=None):
+    """Registra el `usage` de una respuesta y actualiza los totales del tema en el proceso."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    record = {
+        "topic": topic,
+        "model": model,
+        "prefix_hash": instructions_hash,
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cost_usd": usage_cost(model, usage.prompt_tokens, cached_tokens, usage.completion_tokens),
+    }
+    with _usage_lock:
+        totals = _usage_by_topic.setdefault(topic, {
+            "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+        })
+        totals["calls"] += 1
+        totals["prompt_tokens"] += record["prompt_tokens"]
+        totals["cached_tokens"] += record["cached_tokens"]
+        totals["completion_tokens"] += record["completion_tokens"]
+        totals["cost_usd"] += record["cost_usd"] or 0.0
+    return record
+
+def summarize_usage(records):
+    """Resume una lista de registros (por ejemplo, los de una conversación)."""
+    prompt_tokens = sum(r["prompt_tokens"] for r in records)
+    cached_tokens = sum(r["cached_tokens"] for r in records)
+    return {
+        "calls": len(records),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": sum(r["completion_tokens"] for r in records),
+        "cache_hit_rate": (cached_tokens / prompt_tokens) if prompt_tokens else 0.0,
+        "cost_usd": sum(r["cost_usd"] or 0.0 for r in records),
+    }
+
+def usage_rollups():
+    """Totales por tema desde que arrancó el proceso, con la tasa de aciertos del caché."""
+    with _usage_lock:
+        rollups = {topic: dict(totals) for topic, totals in _usage_by_topic.items()}
+    for totals in rollups.values():
+        prompt_tokens = totals["prompt_tokens"]
+        totals["cache_hit_rate"] = (totals["cached_tokens"] / prompt_tokens) if prompt_tokens else 0.0
+    return rollups
@@ -0,0 +1,118 @@
+# clients.py
+"""
+Registro de clientes compartidos por proceso (OpenAI, ElevenLabs y MongoDB).
+
+Los clientes se crean la primera vez que se piden y se reutilizan entre reruns de
+Streamlit y entre sesiones, manteniendo abiertas las conexiones HTTP y el pool de Mongo.
+"""
+import time
+import threading
+import streamlit as st
+
+CLIENT_CONFIG = {
+    "http_max_connections": 50,
+    "http_max_keepalive": 20,
+    "http_keepalive_expiry": 60.0,   # Segundos que una conexión ociosa sigue abierta
+    "http_timeout": 60.0,
+    "mongo_max_pool_size": 20,
+    "mongo_server_selection_timeout_ms": 5000,
+    "mongo_health_check_interval": 30.0,  # Segundos entre pings de verificación
+}
+
+_lock = threading.RLock()
+_clients = {}
+_mongo_last_check = 0.0
+
+
+def _http_client():
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=CLIENT_CONFIG["http_max_connections"],
+            max_keepalive_connections=CLIENT_CONFIG["http_max_keepalive"],
+            keepalive_expiry=CLIENT_CONFIG["http_keepalive_expiry"],
+        ),
+        timeout=CLIENT_CONFIG["http_timeout"],
+    )
+
+def get_openai_client():
+    """Cliente de OpenAI compartido, con pool de conexiones keep-alive."""
+    with _lock:
+        if "openai" not in _clients:
+            from openai import OpenAI
+            # Sin reintentos propios: los maneja upstream.py, con límites compartidos entre sesiones
+            # base_url opcional: permite apuntar a un servidor local (bench_load.py)
+            _clients["openai"] = OpenAI(api_key=st.secrets["openai"]["api_key"],
+                                        base_url=st.secrets["openai"].get("base_url"),
+                                        http_client=_http_client(), max_retries=0)
+        return _clients["openai"]
+
+def get_elevenlabs_client():
+    """Cliente de ElevenLabs compartido, con pool de conexiones keep-alive."""
+    with _lock:
+        if "elevenlabs" not in _clients:
+            from elevenlabs import ElevenLabs
+            options = {"base_url": st.secrets["elevenlabs"]["base_url"]} if st.secrets["elevenlabs"].get("base_url") else {}
+            _clients["elevenlabs"] = ElevenLabs(api_key=st.secrets["elevenlabs"]["api_key"],
+                                                httpx_client=_http_client(), **options)
+        return _clients["elevenlabs"]
+
+def _create_mongo_client():
+    # TLS y Server API siempre, salvo `tls = false` en [mongodb] (mongod local de bench_load.py)
+    from settings import open_mongo_client
+    return open_mongo_client(
+        dict(st.secrets["mongodb"]),
+        maxPoolSize=CLIENT_CONFIG["mongo_max_pool_size"],
+        serverSelectionTimeoutMS=CLIENT_CONFIG["mongo_server_selection_timeout_ms"],
+        retryWrites=True,
+    )
+
+def get_mongo_client():
+    """
+    MongoClient de larga duración. Se verifica con un ping cada cierto intervalo
+    (no en cada llamada) y se reconecta si la verificación falla. El ping corre fuera del
+    lock: si Mongo está lento, las demás sesiones siguen usando el cliente actual.
+    """
+    global _mongo_last_check
+    with _lock:
+        client = _clients.get("mongo")
+        if client is None:
+            client = _clients["mongo"] = _create_mongo_client()
+            _mongo_last_check = 0.0
+        now = time.monotonic()
+        if now - _mongo_last_check < CLIENT_CONFIG["mongo_health_check_interval"]:
+            return client
+        _mongo_last_check = now  # Una sola sesión verifica por intervalo
+    try:
+        client.admin.command('ping')
+        return client
+    except Exception as e:
+        print(f"DEBUG: Falló la verificación de MongoDB, reconectando: {e}")
+    fresh = _create_mongo_client()
+    with _lock:
+        current = _clients.get("mongo")
+        if current is client or current is None:
+            _clients["mongo"] = current = fresh
+            stale = client
+        else:
+            stale = fresh  # Otra sesión ya lo reemplazó
+    _close_quietly(stale)
+    return current
+
+def get_mongo_db():
+    return get_mongo_client()[st.secrets["mongodb"]["db_name"]]
+
+def reset_mongo_client():
+    """Descarta el cliente actual; el próximo pedido crea uno nuevo."""
+    global _mongo_last_check
+    with _lock:
+        client = _clients.pop("mongo", None)
+        _mongo_last_check = 0.0
+    if client is not None:
+        _close_quietly(client)
+
+def _close_quietly(client):
+    try:
+        client.close()
+    except Exception:
+        pass
@@ -0,0 +1,150 @@
+# conversation_history.py
+"""
+Presupuesto de tokens para el historial que se envía a OpenAI.
+
+Se mantienen textuales los últimos turnos y los anteriores se resumen en un texto
+acumulado. El historial completo sigue en st.session_state.messages (auto-guardado y PDF),
+como registros ChatMessage.
+"""
+import sys
+import upstream
+
+HISTORY_CONFIG = {
+    "max_history_tokens": 3000,   # Tope para los turnos enviados textualmente
+    "keep_last_turns": 4,         # Turnos (usuario + asistente) que se mantienen textuales
+    "summary_model": "gpt-4o-mini",
+    "summary_max_tokens": 400,
+    "encoding": "o200k_base",
+}
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Tokens de formato que agrega cada mensaje
+
+SUMMARY_PROMPT = (
+    "Resumí en español y en pocas líneas la conversación entre un usuario y SofIA, "
+    "la asesora virtual de I-COMEX. Conservá el nombre del usuario, su empresa o producto, "
+    "lo que ya se le respondió y las preguntas pendientes. No agregues información nueva."
+)
+
+_encoding = None  # False si tiktoken no está instalado
+
+
+class ChatMessage:
+    """
+    Mensaje de la sesión: solo rol y texto, sin diccionario por instancia. Se lee como un dict
+    (m["role"], m.get(...), dict(m)), así el resto del código no distingue entre ambos.
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        try:
+            return self.role == other["role"] and self.content == other["content"]
+        except (KeyError, TypeError):
+            return NotImplemented
+
+    def __repr__(self):
+        return f"ChatMessage({self.role!r}, {self.content[:40]!r})"
+
+    def __getstate__(self):
+        return (self.role, self.content)
+
+    def __setstate__(self, state):
+        self.role, self.content = state
+
+
+def count_tokens(text):
+    """Cuenta tokens localmente (tiktoken si está disponible, si no ~4 caracteres por token)."""
+    global _encoding
+    if _encoding is None:
+        # Import diferido: tiktoken tarda en cargar y la primera página no lo necesita
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(HISTORY_CONFIG["encoding"])
+        except ImportError:  # tiktoken es opcional; sin él se estima por caracteres
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+def count_message_tokens(messages):
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+def new_summary_state():
+    return {"text": "", "covered": 0}
+
+def conversation_messages(messages):
+    return [m for m in messages if m["role"] != "system"]
+
+def recent_start(pending):
+    """Índice dentro de `pending` desde el cual los mensajes se envían textuales."""
+    user_positions = [i for i, m in enumerate(pending) if m["role"] == "user"]
+    turns = min(HISTORY_CONFIG["keep_last_turns"], len(user_positions))
+    while turns > 1:
+        start = user_positions[-turns]
+        if count_message_tokens(pending[start:]) <= HISTORY_CONFIG["max_history_tokens"]:
+            return start
+        turns -= 1
+    return user_positions[-1] if user_positions else 0
+
+def history_for_request(messages, summary_state):
+    """
+    Devuelve (resumen, mensajes textuales) a enviar en el próximo pedido. Si el resumen no
+    alcanzó a cubrir los turnos viejos (por ejemplo, porque falló la llamada que resume), se
+    descartan los más viejos para respetar el presupuesto de tokens.
+    """
+    pending = conversation_messages(messages)[summary_state["covered"]:]
+    if count_message_tokens(pending) > HISTORY_CONFIG["max_history_tokens"]:
+        pending = pending[recent_start(pending):]
+    return summary_state["text"], pending
+
+def summarize(client, previous_summary, messages):
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Resumen previo:\n{previous_summary}\n\nNuevos mensajes:\n{transcript}"
+    response = upstream.call(
+        "openai", client.chat.completions.create,
+        model=HISTORY_CONFIG["summary_model"],
+        messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+        temperature=0,
+        max_tokens=HISTORY_CONFIG["summary_max_tokens"],
+    )
+    return response.choices[0].message.content.strip()
+
+def fold_history(client, messages, summary_state):
+    """
+    Si los mensajes aún no resumidos exceden el presupuesto, incorpora los turnos
+    más viejos al resumen. Se llama al final del turno, después de mostrar la respuesta.
+    """
+    pending = conversation_messages(messages)[summary_state["covered"]:]
+    if count_message_tokens(pending) <= HISTORY_CONFIG["max_history_tokens"]:
+        return summary_state
+    start = recent_start(pending)
+    if start == 0:
+        return summary_state
+    try:
+        text = summarize(client, summary_state["text"], pending[:start])
+    except Exception as e:
+        # Sin resumen nuevo, history_for_request recorta los turnos viejos hasta el próximo intento
+        print(f"DEBUG: No se pudo resumir el historial: {e}")
+        return summary_state
+    return {"text": text, "covered": summary_state["covered"] + start}
@@ -0,0 +1,240 @@
+# export_analytics.py
+"""
+Exportación incremental de las conversaciones a archivos columnares (Parquet o Arrow)
+para análisis.
+
+Aplana tres tablas, particionadas por fecha y tema (date=AAAA-MM-DD/topic=...):
+    sessions      una fila por sesión y corrida (la más reciente por session_id es la vigente)
+    messages      una fila por mensaje y corrida en la que cambió su sesión, con su largo en
+                  caracteres (el texto es opcional); (session_id, seq) identifica el mensaje
+    pdf_requests  una fila por conversación enviada por el formulario (sin datos personales)
+
+Las conversaciones se eligen por `updated_at`, la hora del servidor en que se aplicó la
+última escritura: una escritura que pasó por el journal del escritor y se reprodujo más
+tarde queda después de la marca de agua y se exporta en la corrida siguiente (saved_at y
+timestamp se anotan al encolar y pueden quedar atrás). Cada corrida lee lo que está entre
+la marca de agua guardada en <out>/_state.json y "ahora menos safety_lag". Los pedidos de
+PDF se escriben directo (sin journal) y se eligen por su timestamp. La proyección y el
+largo de los textos se calculan en el servidor y el cursor se lee por lotes; cada lote se
+escribe como archivos nuevos, sin reescribir los anteriores.
+
+Uso:
+    python export_analytics.py [--out analytics] [--format parquet|arrow] [--include-content]
+    python export_analytics.py --full   # ignora la marca de agua y exporta todo de nuevo
+"""
+import os
+import json
+import uuid
+import argparse
+from datetime import datetime, timedelta
+import pytz
+from settings import mongo_settings, open_mongo_client
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # Opcional: solo lo necesita este script
+    pa = None
+
+ANALYTICS_CONFIG = {
+    "out_dir": "analytics",
+    "format": "parquet",
+    "batch_size": 5000,             # Filas por lote (y tamaño de lote del cursor)
+    "safety_lag_seconds": 300,      # No exportar lo escrito en los últimos 5 minutos (desfase de relojes)
+    "timezone": "America/Argentina/Buenos_Aires",
+}
+
+TABLE_SCHEMAS = {
+    "sessions": [
+        ("session_id", "string"), ("topic", "string"), ("created_at", "string"),
+        ("timestamp", "string"), ("message_count", "int64"), ("user_turns", "int64"),
+        ("calls", "int64"), ("prompt_tokens", "int64"), ("cached_tokens", "int64"),
+        ("completion_tokens", "int64"), ("cost_usd", "float64"), ("kb_version", "string"),
+        ("date", "string"),
+    ],
+    "messages": [
+        ("session_id", "string"), ("topic", "string"), ("seq", "int64"), ("role", "string"),
+        ("content_chars", "int64"), ("content", "string"), ("saved_at", "string"),
+        ("date", "string"),
+    ],
+    "pdf_requests": [
+        ("session_id", "string"), ("topic", "string"), ("timestamp", "string"),
+        ("message_count", "int64"), ("pdf_gridfs_id", "string"), ("date", "string"),
+    ],
+}
+PARTITION_COLUMNS = ["date", "topic"]
+
+
+# --- Estado (marca de agua) ---
+
+def state_path(out_dir):
+    return os.path.join(out_dir, "_state.json")
+
+def load_state(out_dir):
+    try:
+        with open(state_path(out_dir), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def save_state(out_dir, state):
+    """Escritura atómica: si la corrida se corta, la marca de agua anterior queda intacta."""
+    temp_path = state_path(out_dir) + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, state_path(out_dir))
+
+
+# --- Consultas (proyección y cálculos en el servidor) ---
+
+def time_window(field, since, until):
+    window = {"$lte": until}
+    if since:
+        window["$gt"] = since
+    return {field: window}
+
+def written_window(since, until):
+    """Conversaciones escritas en la ventana (hora del servidor); la primera corrida incluye las
+    guardadas antes de que existiera updated_at."""
+    if since:
+        return time_window("updated_at", since, until)
+    return {"$or": [time_window("updated_at", None, until), {"updated_at": {"$exists": False}}]}
+
+def sessions_pipeline(since, until):
+    return [
+        {"$match": written_window(since, until)},
+        {"$project": {
+            "_id": 0, "session_id": 1, "topic": 1, "created_at": 1, "timestamp": 1,
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+            "user_turns": {"$size": {"$filter": {
+                "input": {"$ifNull": ["$messages", []]}, "cond": {"$eq": ["$$this.role", "user"]}}}},
+            "calls": "$token_usage.calls", "prompt_tokens": "$token_usage.prompt_tokens",
+            "cached_tokens": "$token_usage.cached_tokens",
+            "completion_tokens": "$token_usage.completion_tokens", "cost_usd": "$token_usage.cost_usd",
+            "kb_version": 1,
+        }},
+    ]
+
+def messages_pipeline(since, until, include_content=False):
+    """
+    Todos los mensajes de las conversaciones escritas en la ventana. El saved_at de cada mensaje
+    es la hora en que se encoló, no en que se aplicó, así que no sirve para saber cuáles son
+    nuevos: una sesión que sigue activa entre corridas repite sus mensajes anteriores (se
+    deduplican por session_id y seq, como las filas de sessions).
+    """
+    project = {
+        "_id": 0, "session_id": 1, "topic": 1, "seq": "$messages.seq", "role": "$messages.role",
+        "content_chars": {"$strLenCP": {"$ifNull": ["$messages.content", ""]}},
+        # Los mensajes guardados antes de que existiera saved_at toman el timestamp de la sesión
+        "saved_at": {"$ifNull": ["$messages.saved_at", "$timestamp"]},
+    }
+    if include_content:
+        project["content"] = "$messages.content"
+    return [
+        {"$match": written_window(since, until)},
+        {"$project": {"session_id": 1, "topic": 1, "timestamp": 1, "messages": 1}},
+        {"$unwind": "$messages"},
+        {"$project": project},
+    ]
+
+def pdf_requests_pipeline(since, until):
+    return [
+        {"$match": time_window("timestamp", since, until)},
+        {"$project": {
+            "_id": 0, "session_id": 1, "topic": 1, "timestamp": 1,
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+            "pdf_gridfs_id": {"$toString": "$pdf_gridfs_id"},
+        }},
+    ]
+
+
+# --- Escritura ---
+
+def arrow_schema(table_name):
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in TABLE_SCHEMAS[table_name]])
+
+def row_date(row, table_name):
+    field = "saved_at" if table_name == "messages" else "timestamp"
+    return (row.get(field) or "")[:10] or "unknown"
+
+def write_batch(rows, table_name, out_dir, file_format, run_id, batch_number):
+    schema = arrow_schema(table_name)
+    for row in rows:
+        row["date"] = row_date(row, table_name)
+        row["topic"] = row.get("topic") or "unknown"
+    table = pa.Table.from_pylist(rows, schema=schema)
+    extension = "parquet" if file_format == "parquet" else "arrow"
+    ds.write_dataset(
+        table, os.path.join(out_dir, table_name),
+        format="parquet" if file_format == "parquet" else "ipc",
+        partitioning=PARTITION_COLUMNS, partitioning_flavor="hive",
+        basename_template=f"part-{run_id}-{batch_number:05d}-{{i}}.{extension}",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+def export_table(collection, pipeline, table_name, out_dir, file_format, run_id, batch_size):
+    """Recorre el cursor por lotes y escribe cada lote como archivos nuevos. Devuelve las filas."""
+    cursor = collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    rows, total, batch_number = [], 0, 0
+    for doc in cursor:
+        rows.append(doc)
+        if len(rows) >= batch_size:
+            write_batch(rows, table_name, out_dir, file_format, run_id, batch_number)
+            total, batch_number, rows = total + len(rows), batch_number + 1, []
+    if rows:
+        write_batch(rows, table_name, out_dir, file_format, run_id, batch_number)
+        total += len(rows)
+    return total
+
+def run_export(db, settings, out_dir=None, file_format=None, include_content=False, full=False, now=None):
+    """Exporta lo nuevo desde la última corrida y avanza la marca de agua. Devuelve filas por tabla."""
+    if pa is None:
+        raise ImportError("Falta pyarrow: pip install pyarrow")
+    out_dir = out_dir or ANALYTICS_CONFIG["out_dir"]
+    file_format = file_format or ANALYTICS_CONFIG["format"]
+    batch_size = ANALYTICS_CONFIG["batch_size"]
+    os.makedirs(out_dir, exist_ok=True)
+    state = {} if full else load_state(out_dir)
+    now = now or datetime.now(pytz.timezone(ANALYTICS_CONFIG["timezone"]))
+    until = now - timedelta(seconds=ANALYTICS_CONFIG["safety_lag_seconds"])
+    run_id = uuid.uuid4().hex[:12]
+
+    # updated_at es una fecha BSON; el timestamp de los pedidos de PDF, texto ISO
+    sources = [
+        ("sessions", settings["collection_name"], lambda since: sessions_pipeline(since, until)),
+        ("messages", settings["collection_name"], lambda since: messages_pipeline(since, until, include_content)),
+        ("pdf_requests", settings.get("pdf_metadata_collection"),
+         lambda since: pdf_requests_pipeline(since and since.isoformat(), until.isoformat())),
+    ]
+    counts = {}
+    for table_name, collection_name, pipeline_for in sources:
+        if not collection_name:
+            continue
+        since = datetime.fromisoformat(state[table_name]) if state.get(table_name) else None
+        counts[table_name] = export_table(db[collection_name], pipeline_for(since), table_name,
+                                          out_dir, file_format, run_id, batch_size)
+        # La marca de agua avanza tabla por tabla, solo después de escribir sus archivos
+        state[table_name] = until.isoformat()
+        save_state(out_dir, state)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta las conversaciones a Parquet/Arrow para análisis.")
+    parser.add_argument("--out", default=ANALYTICS_CONFIG["out_dir"], help="Directorio de salida")
+    parser.add_argument("--format", choices=["parquet", "arrow"], default=ANALYTICS_CONFIG["format"])
+    parser.add_argument("--include-content", action="store_true", help="Incluye el texto de cada mensaje")
+    parser.add_argument("--full", action="store_true", help="Ignora la marca de agua y exporta todo (usar con un --out vacío)")
+    args = parser.parse_args()
+
+    settings = mongo_settings()
+    client = open_mongo_client(settings)
+    try:
+        counts = run_export(client[settings["db_name"]], settings, args.out, args.format,
+                            include_content=args.include_content, full=args.full)
+        print(", ".join(f"{table}: {count} filas" for table, count in counts.items()) + f" -> {args.out}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
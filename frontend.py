@@ -1,5 +1,9 @@
 import streamlit as st
 import time
+import re
+import metrics
+import assets
+import prefetch
 
 # Paleta de colores y rutas de los logos
 PRIMARY_COLOR = "#4b83c0"
@@ -9,6 +13,28 @@ BACKGROUND_COLOR = "#f4f5f7"
 ICOMEX_LOGO_PATH = "logos/ICOMEX_Logos sin fondo.png"
 SOFIA_LOGO_PATH = "logos/SofIA sin fondo.png"
 
+# Configuración del efecto de escritura
+TYPING_CONFIG = {
+    "enabled": True,
+    "mode": "word",                # "word" o "sentence"
+    "max_updates": 40,             # Máximo de actualizaciones de UI por mensaje
+    "max_updates_per_second": 25,  # Tope de actualizaciones por segundo
+    "max_animated_chars": 4000,    # Mensajes más largos se muestran completos
+}
+
+# Historial: solo los mensajes recientes se dibujan como burbujas; los anteriores se agrupan
+# en páginas fijas que se muestran a pedido
+CHAT_VIEW_CONFIG = {
+    "visible_messages": 12,   # Mensajes recientes con burbuja propia (entre este valor y este + page_size)
+    "page_size": 20,          # Mensajes por página de "mostrar anteriores"
+    "labels": {"user": "Vos", "assistant": "SofIA"},
+}
+
+TYPING_PATTERNS = {
+    "word": re.compile(r"\S+\s*|\s+"),
+    "sentence": re.compile(r"[^.!?\n]*(?:[.!?]+|\n+|$)\s*"),
+}
+
 # Estilo personalizado
 def render_custom_styles():
     st.markdown(
@@ -83,11 +109,11 @@ def render_title():
     with logo_col1:
         # Center the image in the column
         with st.container():
-            st.image(SOFIA_LOGO_PATH, use_container_width=True)
+            st.image(assets.variant_path(SOFIA_LOGO_PATH, "header"), use_container_width=True)
     with logo_col2:
         # Center the image in the column
         with st.container():
-            st.image(ICOMEX_LOGO_PATH, use_container_width=True)
+            st.image(assets.variant_path(ICOMEX_LOGO_PATH, "header"), use_container_width=True)
 
     # Add a title below the logos, centered
     st.markdown(
@@ -95,28 +121,41 @@ def render_title():
         unsafe_allow_html=True,
     )
 
+# Divide el texto en fragmentos según el modo de escritura
+def split_typing_chunks(text, mode=None):
+    pattern = TYPING_PATTERNS[mode or TYPING_CONFIG["mode"]]
+    return [chunk for chunk in pattern.findall(text) if chunk]
+
+# Escribe el texto en el contenedor con un número acotado de actualizaciones
+@metrics.timed("typing")
+def type_text(render, text, animate=True, mode=None):
+    if (not animate or not TYPING_CONFIG["enabled"]
+            or len(text) > TYPING_CONFIG["max_animated_chars"]):
+        render(text)
+        return
+    chunks = split_typing_chunks(text, mode)
+    steps = max(1, min(len(chunks), TYPING_CONFIG["max_updates"]))
+    per_step = -(-len(chunks) // steps)  # División redondeando hacia arriba
+    interval = 1.0 / TYPING_CONFIG["max_updates_per_second"]
+    displayed_text = ""
+    for start in range(0, len(chunks), per_step):
+        displayed_text += "".join(chunks[start:start + per_step])
+        render(displayed_text)
+        if start + per_step < len(chunks):
+            time.sleep(interval)
+
 # Renderizar subtítulo con efecto de escritura
-def render_subheader(topic):
+def render_subheader(topic, animate=True):
     container = st.empty()  # Crear un contenedor vacío para el texto dinámico
-    text = topic
-    displayed_text = ""
-    for char in text:
-        displayed_text += char
-        container.subheader(displayed_text)  # Actualizar el contenedor
-        time.sleep(0.0)
+    type_text(container.subheader, topic, animate=animate)
 
 # Renderizar mensajes con efecto de escritura
-def render_messages(messages):
+def render_messages(messages, animate=True):
     for message in messages:
         if message["role"] != "system":
             with st.chat_message(message["role"]):
                 container = st.empty()
-                text = message["content"]
-                displayed_text = ""
-                for char in text:
-                    displayed_text += char
-                    container.markdown(displayed_text)
-                    time.sleep(0.002)
+                type_text(container.markdown, message["content"], animate=animate)
 
 # Renderizar la introducción y los botones iniciales
 def render_intro():
@@ -154,37 +193,110 @@ def render_intro():
 def render_input():
     return st.chat_input("Escribe tu mensaje aquí...")
 
-# Funciones de selección
-def select_investment():
-    st.session_state.selected_topic = "Oportunidades de Inversión"
-    st.session_state.initial_message = (
+# Saludos fijos por tema (también se usan para precalentar el caché de audio)
+GREETINGS = {
+    "Oportunidades de Inversión": (
         "¡Hola! Soy Sofía, la asesora virtual de I-COMEX 😊. "
         "Parece que te interesan las oportunidades de inversión en La Pampa. "
         "Decime, ¿cuál es tu nombre y qué aspecto en particular quisieras saber?"
-    )
+    ),
+    "¡Quiero exportar!": (
+        "¡Hola! Soy Sofía, la asesora virtual de I-COMEX 😊. "
+        "Me alegra saber que querés exportar, estoy aquí para ayudarte. "
+        "Contame, ¿cómo te llamás y qué estás pensando exportar?"
+    ),
+}
+
+# Funciones de selección
+def select_investment():
+    st.session_state.selected_topic = "Oportunidades de Inversión"
+    st.session_state.initial_message = GREETINGS["Oportunidades de Inversión"]
     st.session_state.initial_message_shown = False
+    start_prefetch("Oportunidades de Inversión")
 
 def select_export():
     st.session_state.selected_topic = "¡Quiero exportar!"
-    st.session_state.initial_message = (
-        "¡Hola! Soy Sofía, la asesora virtual de I-COMEX 😊. "
-        "Me alegra saber que querés exportar, estoy aquí para ayudarte. "
-        "Contame, ¿cómo te llamás y qué estás pensando exportar?"
-    )
+    st.session_state.initial_message = GREETINGS["¡Quiero exportar!"]
     st.session_state.initial_message_shown = False
+    start_prefetch("¡Quiero exportar!")
 
-def render_dynamic_message(message, avatar=None):
+# Precalentar instrucciones y conexiones mientras se escribe el saludo
+def start_prefetch(topic):
+    previous = st.session_state.get("prefetch")
+    if previous is not None:
+        previous.cancel()
+    st.session_state.prefetch = prefetch.start(topic, audio=st.session_state.get("audio_enabled", False))
+
+def render_dynamic_message(message, avatar=None, animate=True):
     if message["role"] == "assistant":
         with st.chat_message(message["role"], avatar=avatar):
             container = st.empty()
-            text = message["content"]
-            displayed_text = ""
-            for char in text:
-                displayed_text += char
-                container.markdown(displayed_text)
-                time.sleep(0.0005)
+            type_text(container.markdown, message["content"], animate=animate)
+
+# Escribir los fragmentos en un contenedor existente, limitando las actualizaciones por segundo
+def stream_markdown(container, deltas):
+    displayed_text = ""
+    interval = 1.0 / TYPING_CONFIG["max_updates_per_second"]
+    last_update = 0.0
+    for delta in deltas:
+        displayed_text += delta
+        now = time.perf_counter()
+        if now - last_update >= interval:
+            container.markdown(displayed_text + "▌")
+            last_update = now
+    container.markdown(displayed_text)
+    return displayed_text
 
 # Renderizar mensaje estático con avatar
 def render_chat_message(role, content, avatar=None):
     with st.chat_message(role, avatar=avatar):
         st.markdown(content)
+
+# --- Historial paginado ---
+
+def recent_start(total):
+    """
+    Índice del primer mensaje con burbuja propia. Se alinea al inicio de una página, así las
+    páginas anteriores quedan completas y no cambian cuando llegan mensajes nuevos.
+    """
+    page_size = CHAT_VIEW_CONFIG["page_size"]
+    return (max(0, total - CHAT_VIEW_CONFIG["visible_messages"]) // page_size) * page_size
+
+def show_earlier_page():
+    st.session_state.history_pages = st.session_state.get("history_pages", 0) + 1
+
+def hide_earlier_pages():
+    st.session_state.history_pages = 0
+
+def page_markdown(messages, page):
+    """Texto de una página del historial (mensajes de sistema excluidos), armado una sola vez."""
+    cache = st.session_state.setdefault("history_page_cache", {})
+    if page not in cache:
+        page_size = CHAT_VIEW_CONFIG["page_size"]
+        labels = CHAT_VIEW_CONFIG["labels"]
+        cache[page] = "\n\n---\n\n".join(
+            f"**{labels.get(m['role'], m['role'])}:** {m['content']}"
+            for m in messages[page * page_size:(page + 1) * page_size] if m["role"] != "system")
+    return cache[page]
+
+def render_earlier_messages(messages):
+    """
+    Dibuja el control para ver mensajes anteriores y las páginas pedidas (un solo bloque de
+    texto por página). Devuelve el índice desde el que hay que dibujar burbujas.
+    """
+    start = recent_start(len(messages))
+    if not start:
+        return 0
+    page_size = CHAT_VIEW_CONFIG["page_size"]
+    last_page = start // page_size
+    pages = min(st.session_state.get("history_pages", 0), last_page)
+    if pages < last_page:
+        st.button("Mostrar mensajes anteriores", key="show_earlier", on_click=show_earlier_page)
+    if pages:
+        st.button("Ocultar mensajes anteriores", key="hide_earlier", on_click=hide_earlier_pages)
+        for page in range(last_page - pages, last_page):
+            text = page_markdown(messages, page)
+            if text:
+                with st.container(border=True):
+                    st.markdown(text)
+    return start
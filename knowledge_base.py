@@ -0,0 +1,387 @@
+# knowledge_base.py
+"""
+Índice de recuperación (BM25) sobre la sección "# CONOCIMIENTOS" de los archivos de instrucciones,
+y registro de versiones de cada tema cargado una vez por proceso.
+
+El registro revisa el archivo (mtime y tamaño, como mucho cada `check_interval` segundos) y,
+si cambió el contenido, arma una versión nueva y la reemplaza de una sola vez. Cada versión
+tiene un id (hash del contenido), las secciones con sus posiciones en el texto y la cantidad
+de tokens. Las sesiones quedan fijadas a la versión vigente cuando eligieron el tema.
+
+Uso por línea de comandos para reconstruir el índice cuando cambian los .txt:
+    python knowledge_base.py --rebuild
+    python knowledge_base.py --topic "¡Quiero exportar!" --query "¿qué necesito para exportar servicios?"
+    python knowledge_base.py --info
+"""
+import os
+import re
+import math
+import time
+import json
+import hashlib
+import argparse
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from conversation_history import count_tokens
+
+INSTRUCTIONS_FILES = {
+    "Oportunidades de Inversión": "instructions_inversiones.txt",
+    "¡Quiero exportar!": "instructions_comercio_exterior.txt",
+}
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(SCRIPT_DIR, "kb_index")
+INDEX_FORMAT_VERSION = 2
+
+# Configuración de la recuperación
+RETRIEVAL_CONFIG = {
+    "enabled": True,
+    "top_k": 4,
+    "k1": 1.5,
+    "b": 0.75,
+    "heading_weight": 3,  # Las palabras del título cuentan varias veces
+    "max_context_chars": 16000,  # Tope de caracteres recuperados por turno
+}
+
+# Recarga en caliente de los archivos de instrucciones
+REGISTRY_CONFIG = {
+    "check_interval": float(os.environ.get("SOFIA_KB_CHECK_INTERVAL", "2")),  # Segundos entre revisiones
+    "settle_seconds": 1.0,   # Un archivo modificado hace menos que esto puede estar a medio escribir
+    "max_versions": 4,       # Versiones por tema que se conservan para las sesiones fijadas
+}
+
+KNOWLEDGE_HEADING = re.compile(r"^#\s+CONOCIMIENTOS\s*$", re.MULTILINE)
+SECTION_HEADING = re.compile(r"^(#{2,4})\s+(.*?)\s*$", re.MULTILINE)
+BRACKET_NOTE = re.compile(r"\s*\[.*?\]\s*")
+TOKEN_PATTERN = re.compile(r"[a-z0-9ñ]{2,}")
+# Títulos (normalizados) dentro de CONOCIMIENTOS que son reglas o guías de respuesta, no conocimiento:
+# quedan en la parte fija del prompt junto con sus subsecciones
+FIXED_HEADING = re.compile(r"^(indice|reglas\b|bases de respuesta|(seccion de )?preguntas frecuentes)")
+
+STOPWORDS = frozenset("""
+    al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con contra cual cuales
+    cuando de del desde donde dos el ella ellas ellos en entre era es esa esas ese eso esos esta estan estas
+    este esto estos fue ha hay la las le les lo los mas me mi mis mucho muy no nos o otra otras otro otros para
+    pero poco por porque puede que quien se segun ser si sin sobre son su sus tambien te tener tiene tu tus un
+    una uno unos vos ya yo
+""".split())
+
+
+# --- Lectura y partición de las instrucciones ---
+
+def instructions_path(topic):
+    return os.path.join(SCRIPT_DIR, INSTRUCTIONS_FILES[topic])
+
+def read_instructions(topic):
+    with open(instructions_path(topic), "r", encoding="utf-8") as file:
+        return file.read().strip()
+
+
+def is_fixed_heading(title):
+    """El índice de conceptos, las reglas y las guías de respuesta se mantienen en la parte fija del prompt."""
+    return bool(FIXED_HEADING.match(normalize_text(title)))
+
+def split_instructions(text):
+    """
+    Separa las instrucciones en la parte fija (persona, reglas, guías de respuesta e índice)
+    y las secciones de conocimiento, cortando en los títulos ##, ### y ####.
+    """
+    match = KNOWLEDGE_HEADING.search(text)
+    if not match:
+        return text, []
+
+    fixed_parts = [text[:match.end()]]
+    sections = []
+    headings = list(SECTION_HEADING.finditer(text, match.end()))
+    path = {}
+    fixed_level = None  # Nivel del título fijo cuyas subsecciones también quedan fijas
+    for i, heading in enumerate(headings):
+        level = len(heading.group(1))
+        title = BRACKET_NOTE.sub(" ", heading.group(2)).strip()
+        path = {lvl: t for lvl, t in path.items() if lvl < level}
+        path[level] = title
+        start = heading.start()
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        section_text = text[start:end].strip()
+
+        if fixed_level is not None and level <= fixed_level:
+            fixed_level = None
+        if fixed_level is None and is_fixed_heading(title):
+            fixed_level = level
+        if fixed_level is not None:
+            fixed_parts.append(section_text)
+            continue
+        sections.append({
+            "id": len(sections),
+            "path": [path[lvl] for lvl in sorted(path)],
+            "text": section_text,
+            "start": start,
+            "end": end,
+        })
+    return "\n\n".join(fixed_parts), sections
+
+
+# --- Tokenización y BM25 ---
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    # Quitar tildes pero conservar la ñ (n + tilde combinada)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch) or ch == "\u0303")
+    return unicodedata.normalize("NFC", text)
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(normalize_text(text)) if token not in STOPWORDS]
+
+def section_terms(section):
+    heading_terms = tokenize(" ".join(section["path"])) * RETRIEVAL_CONFIG["heading_weight"]
+    return Counter(heading_terms + tokenize(section["text"]))
+
+def source_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def build_index(topic, text=None):
+    """Construye el índice BM25 para un tema a partir de su archivo de instrucciones."""
+    text = read_instructions(topic) if text is None else text
+    fixed_text, sections = split_instructions(text)
+    term_freqs = [dict(section_terms(section)) for section in sections]
+    doc_freq = Counter()
+    for freqs in term_freqs:
+        doc_freq.update(freqs.keys())
+    lengths = [sum(freqs.values()) for freqs in term_freqs]
+    return {
+        "format": INDEX_FORMAT_VERSION,
+        "topic": topic,
+        "source_hash": source_hash(text),
+        "fixed_text": fixed_text,
+        "sections": sections,
+        "term_freqs": term_freqs,
+        "doc_freq": dict(doc_freq),
+        "lengths": lengths,
+        "avg_length": (sum(lengths) / len(lengths)) if lengths else 0.0,
+    }
+
+def index_path(topic):
+    file_name = os.path.splitext(INSTRUCTIONS_FILES[topic])[0]
+    return os.path.join(INDEX_DIR, f"{file_name}.json")
+
+def save_index(index):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = index_path(index["topic"])
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(index, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+    return path
+
+def load_index(topic, text=None):
+    """Carga el índice desde disco; si falta o quedó desactualizado, lo reconstruye."""
+    text = read_instructions(topic) if text is None else text
+    current_hash = source_hash(text)
+    try:
+        with open(index_path(topic), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        if index.get("format") == INDEX_FORMAT_VERSION and index.get("source_hash") == current_hash:
+            return index
+    except (FileNotFoundError, ValueError):
+        pass
+    index = build_index(topic, text)
+    try:
+        save_index(index)
+    except OSError as e:
+        print(f"DEBUG: No se pudo guardar el índice de {topic}: {e}")
+    return index
+
+def score_sections(index, query):
+    k1, b = RETRIEVAL_CONFIG["k1"], RETRIEVAL_CONFIG["b"]
+    total_docs = len(index["sections"])
+    avg_length = index["avg_length"] or 1.0
+    query_terms = set(tokenize(query))
+    scores = []
+    for doc_id, freqs in enumerate(index["term_freqs"]):
+        score = 0.0
+        length_norm = k1 * (1 - b + b * index["lengths"][doc_id] / avg_length)
+        for term in query_terms:
+            tf = freqs.get(term)
+            if not tf:
+                continue
+            df = index["doc_freq"][term]
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + length_norm)
+        if score > 0:
+            scores.append((score, doc_id))
+    scores.sort(reverse=True)
+    return scores
+
+def retrieve(index, query, top_k=None):
+    """Devuelve las secciones más relevantes para la consulta, en el orden del documento."""
+    top_k = top_k or RETRIEVAL_CONFIG["top_k"]
+    best = sorted(doc_id for _, doc_id in score_sections(index, query)[:top_k])
+    return [index["sections"][doc_id] for doc_id in best]
+
+def build_context(index, query, top_k=None):
+    """Arma el bloque de conocimientos relevantes que se agrega al turno."""
+    sections = retrieve(index, query, top_k)
+    if not sections:
+        return ""
+    parts = ["Conocimientos relevantes para esta consulta:"]
+    used_chars = 0
+    for section in sections:
+        if parts[1:] and used_chars + len(section["text"]) > RETRIEVAL_CONFIG["max_context_chars"]:
+            continue
+        parts.append(f"[{' > '.join(section['path'])}]\n{section['text']}")
+        used_chars += len(section["text"])
+    return "\n\n".join(parts)
+
+
+# --- Registro de versiones ---
+
+class KnowledgeVersion:
+    """Una versión inmutable de las instrucciones de un tema."""
+
+    def __init__(self, topic, text, index):
+        self.topic = topic
+        self.version_id = index["source_hash"][:16]
+        self.text = text
+        self.index = index
+        self.fixed_text = index["fixed_text"]
+        self.sections = index["sections"]  # Cada una con "start" y "end" dentro de `text`
+        self.token_count = count_tokens(text)
+        self.fixed_token_count = count_tokens(self.fixed_text)
+        self.loaded_at = time.time()
+
+    @property
+    def prompt_text(self):
+        """Texto del mensaje de sistema: con recuperación, solo la parte fija (persona y reglas)."""
+        return self.fixed_text if RETRIEVAL_CONFIG["enabled"] else self.text
+
+    def describe(self):
+        return {"topic": self.topic, "version_id": self.version_id, "sections": len(self.sections),
+                "token_count": self.token_count, "fixed_token_count": self.fixed_token_count,
+                "loaded_at": self.loaded_at}
+
+
+class KnowledgeRegistry:
+    """Versión vigente de cada tema, más las anteriores que todavía pueden estar fijadas en sesiones."""
+
+    def __init__(self, check_interval, settle_seconds, max_versions):
+        self.check_interval = check_interval
+        self.settle_seconds = settle_seconds
+        self.max_versions = max_versions
+        self._current = {}      # tema -> KnowledgeVersion
+        self._versions = {}     # tema -> OrderedDict(version_id -> KnowledgeVersion)
+        self._signatures = {}   # tema -> (mtime_ns, tamaño) del archivo leído
+        self._checked = {}      # tema -> momento de la última revisión
+        self._lock = threading.Lock()
+
+    def current(self, topic):
+        """Versión vigente; revisa el archivo si pasó `check_interval` desde la última vez."""
+        version = self._current.get(topic)
+        if version is not None and time.monotonic() - self._checked.get(topic, 0.0) < self.check_interval:
+            return version
+        return self._refresh(topic)
+
+    def get(self, topic, version_id):
+        """Una versión conservada, o None si nunca existió o ya se descartó."""
+        with self._lock:
+            return self._versions.get(topic, {}).get(version_id)
+
+    def pinned(self, topic, version_id):
+        """La versión fijada en la sesión; si ya no se conserva, la vigente."""
+        return (version_id and self.get(topic, version_id)) or self.current(topic)
+
+    def _refresh(self, topic):
+        # Un solo hilo relee el archivo; los demás esperan y reciben la misma versión
+        with self._lock:
+            version = self._current.get(topic)
+            now = time.monotonic()
+            if version is not None and now - self._checked.get(topic, 0.0) < self.check_interval:
+                return version
+            self._checked[topic] = now
+            try:
+                stat = os.stat(instructions_path(topic))
+            except OSError as e:
+                if version is None:
+                    raise
+                print(f"DEBUG: No se pudo revisar las instrucciones de {topic}, se mantiene {version.version_id}: {e}")
+                return version
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if version is not None and (signature == self._signatures.get(topic)
+                                        or time.time() - stat.st_mtime < self.settle_seconds):
+                return version
+            text = read_instructions(topic)
+            self._signatures[topic] = signature
+            if version is not None and source_hash(text)[:16] == version.version_id:
+                return version  # Cambió la fecha pero no el contenido
+            new_version = KnowledgeVersion(topic, text, load_index(topic, text))
+            versions = self._versions.setdefault(topic, OrderedDict())
+            versions[new_version.version_id] = new_version
+            while len(versions) > self.max_versions:
+                versions.popitem(last=False)
+            self._current[topic] = new_version  # Reemplazo atómico: las lecturas ven la vieja o la nueva
+            if version is not None:
+                print(f"DEBUG: Instrucciones de {topic} recargadas: {version.version_id} -> {new_version.version_id}")
+            return new_version
+
+    def stats(self):
+        with self._lock:
+            return {topic: dict(version.describe(), retained=list(self._versions.get(topic, {})))
+                    for topic, version in self._current.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Registro de conocimientos compartido por el proceso."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = KnowledgeRegistry(REGISTRY_CONFIG["check_interval"], REGISTRY_CONFIG["settle_seconds"],
+                                          REGISTRY_CONFIG["max_versions"])
+        return _registry
+
+def current_version(topic):
+    return get_registry().current(topic)
+
+def pinned_version(topic, version_id):
+    return get_registry().pinned(topic, version_id)
+
+def shared_instructions(topic):
+    """(versión, texto) vigentes del tema; el texto es la copia única del proceso."""
+    version = current_version(topic)
+    return version.version_id, version.text
+
+def instructions_version(topic):
+    return current_version(topic).version_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de conocimientos de SofIA.")
+    parser.add_argument("--rebuild", action="store_true", help="Reconstruye los índices en disco")
+    parser.add_argument("--topic", choices=list(INSTRUCTIONS_FILES), help="Tema a procesar (por defecto, todos)")
+    parser.add_argument("--query", help="Consulta de prueba para mostrar las secciones recuperadas")
+    parser.add_argument("--top-k", type=int, default=RETRIEVAL_CONFIG["top_k"])
+    parser.add_argument("--info", action="store_true", help="Muestra la versión vigente (id, secciones y tokens)")
+    args = parser.parse_args()
+
+    topics = [args.topic] if args.topic else list(INSTRUCTIONS_FILES)
+    for topic in topics:
+        if args.rebuild:
+            index = build_index(topic)
+            path = save_index(index)
+            print(f"{topic}: {len(index['sections'])} secciones, "
+                  f"{len(index['fixed_text'])} caracteres fijos -> {path}")
+        else:
+            index = load_index(topic)
+        if args.info:
+            info = current_version(topic).describe()
+            print(f"{topic}: versión {info['version_id']}, {info['sections']} secciones, "
+                  f"{info['token_count']} tokens ({info['fixed_token_count']} en la parte fija)")
+        if args.query:
+            print(f"\n{topic}:")
+            for section in retrieve(index, args.query, args.top_k):
+                print(f"  - {' > '.join(section['path'])} ({len(section['text'])} caracteres)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# metrics.py
+"""
+Medición liviana de tiempos por tramo (span) de cada rerun: llamada a OpenAI, efecto de
+tipeo, TTS, auto-guardado, render del historial, etc.
+
+Se activa con SOFIA_METRICS:
+    prometheus  histogramas en memoria servidos en http://SOFIA_METRICS_HOST:SOFIA_METRICS_PORT/metrics
+                (formato de texto de Prometheus) y /metrics.json (por tema y por sesión, con
+                el id de sesión anonimizado). Por defecto solo escucha en 127.0.0.1; para que
+                lo lea un Prometheus externo hay que abrirlo con SOFIA_METRICS_HOST=0.0.0.0
+    json        además, una línea JSON por span en stdout (para la plataforma de logs), también
+                con el id de sesión anonimizado
+Apagado (por defecto), `span` devuelve un contexto vacío compartido y `timed` deja la
+función sin envolver, así el costo es prácticamente nulo.
+"""
+import os
+import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+METRICS_CONFIG = {
+    "mode": os.environ.get("SOFIA_METRICS", "").lower(),   # "", "prometheus" o "json"
+    "host": os.environ.get("SOFIA_METRICS_HOST", "127.0.0.1"),
+    "port": int(os.environ.get("SOFIA_METRICS_PORT", "9464")),
+    "buckets": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    "max_sessions": 500,            # Sesiones con histograma propio (las más recientes)
+}
+
+ENABLED = METRICS_CONFIG["mode"] in ("prometheus", "json")
+_NULL_SPAN = nullcontext()
+
+_context = threading.local()  # Cada sesión de Streamlit corre su script en su propio hilo
+_lock = threading.Lock()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q):
+        """Estimación por buckets (límite superior del bucket que contiene el cuantil)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        for bound, cumulative in zip(self.buckets, self.cumulative()):
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+_by_topic = {}                 # (span, tema) -> Histogram
+_by_session = OrderedDict()    # session_id -> {span: Histogram}
+
+
+def set_context(session_id=None, topic=None):
+    """Etiquetas de los spans del hilo actual (se llama al principio de cada rerun)."""
+    _context.session_id = session_id
+    _context.topic = topic
+
+def current_context():
+    """Etiquetas del hilo actual, para pasarlas a trabajos que corren en otros hilos."""
+    return {"session_id": getattr(_context, "session_id", None), "topic": getattr(_context, "topic", None)}
+
+def observe(name, seconds, topic=None, session_id=None):
+    """Registra una duración ya medida (por ejemplo, el tiempo al primer token)."""
+    if not ENABLED:
+        return
+    topic = topic or getattr(_context, "topic", None) or "-"
+    session_id = session_id or getattr(_context, "session_id", None)
+    with _lock:
+        key = (name, topic)
+        if key not in _by_topic:
+            _by_topic[key] = Histogram(METRICS_CONFIG["buckets"])
+        _by_topic[key].observe(seconds)
+        if session_id:
+            spans = _by_session.pop(session_id, None) or {}
+            _by_session[session_id] = spans  # Al final: la más reciente
+            if name not in spans:
+                spans[name] = Histogram(METRICS_CONFIG["buckets"])
+            spans[name].observe(seconds)
+            while len(_by_session) > METRICS_CONFIG["max_sessions"]:
+                _by_session.popitem(last=False)
+    if METRICS_CONFIG["mode"] == "json":
+        print(json.dumps({"metric": "span", "span": name, "seconds": round(seconds, 6),
+                          "topic": topic, "session_id": anonymize(session_id) if session_id else None},
+                         ensure_ascii=False))
+
+@contextmanager
+def _span(name, topic=None, session_id=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, topic=topic, session_id=session_id)
+
+def span(name, topic=None, session_id=None):
+    """
+    Contexto que mide el bloque: `with metrics.span("openai"): ...`. Fuera del hilo de la
+    sesión (por ejemplo, en el executor del TTS) hay que pasar `topic` y `session_id`.
+    """
+    return _span(name, topic, session_id) if ENABLED else _NULL_SPAN
+
+def timed(name):
+    """Decorador equivalente a envolver la función en `span(name)`."""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return func(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+    return decorator
+
+
+# --- Exportación ---
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def prometheus_text(gauges=None):
+    """Histogramas por tema en formato de texto de Prometheus, más los indicadores dados."""
+    lines = ["# HELP sofia_span_seconds Duración de cada tramo del rerun.",
+             "# TYPE sofia_span_seconds histogram"]
+    with _lock:
+        items = [(key, hist.buckets, hist.cumulative(), hist.count, hist.sum) for key, hist in sorted(_by_topic.items())]
+    for (name, topic), buckets, cumulative, count, total in items:
+        labels = f'span="{_label(name)}",topic="{_label(topic)}"'
+        for bound, value in zip(buckets, cumulative):
+            lines.append(f'sofia_span_seconds_bucket{{{labels},le="{bound}"}} {value}')
+        lines.append(f'sofia_span_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"sofia_span_seconds_sum{{{labels}}} {total}")
+        lines.append(f"sofia_span_seconds_count{{{labels}}} {count}")
+    for name, labels, value in (gauges or []):
+        label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def anonymize(session_id):
+    """Prefijo del SHA-256 del id: permite agrupar por sesión sin exponer el id real."""
+    return hashlib.sha256(str(session_id).encode("utf-8")).hexdigest()[:16]
+
+def snapshot():
+    """Histogramas por tema y por sesión como diccionario (para /metrics.json)."""
+    with _lock:
+        return {
+            "by_topic": {f"{name}|{topic}": hist.as_dict() for (name, topic), hist in _by_topic.items()},
+            "by_session": {anonymize(sid): {name: hist.as_dict() for name, hist in spans.items()}
+                           for sid, spans in _by_session.items()},
+        }
+
+def default_gauges():
+    """
+    Estado de los componentes compartidos: colas de upstream, precalentamientos, tokens y costo
+    por tema, caché de respuestas y escritor de Mongo.
+    """
+    gauges = []
+    try:
+        import upstream
+        for provider, stats in upstream.stats().items():
+            for key in ("queue_depth", "in_flight", "avg_wait", "max_wait"):
+                gauges.append((f"sofia_upstream_{key}", {"provider": provider}, stats[key]))
+            gauges.append(("sofia_upstream_breaker_open", {"provider": provider}, int(stats["state"] == "open")))
+    except Exception as e:
+        print(f"DEBUG: No se pudieron leer las métricas de upstream: {e}")
+    try:
+        import prefetch
+        for result, count in prefetch.stats().items():
+            gauges.append(("sofia_prefetch_total", {"result": result}, count))
+    except Exception as e:
+        print(f"DEBUG: No se pudieron leer las métricas del precalentamiento: {e}")
+    try:
+        import chat_requests
+        for topic, totals in chat_requests.usage_rollups().items():
+            for key in ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "cost_usd"):
+                gauges.append((f"sofia_openai_{key}_total", {"topic": topic}, totals[key]))
+            gauges.append(("sofia_openai_cache_hit_rate", {"topic": topic}, totals["cache_hit_rate"]))
+    except Exception as e:
+        print(f"DEBUG: No se pudo leer el consumo de tokens por tema: {e}")
+    try:
+        import answer_cache
+        if answer_cache.ANSWER_CACHE_CONFIG["enabled"]:
+            stats = answer_cache.get_cache().stats()
+            gauges.append(("sofia_answer_cache_entries", {}, stats.pop("entries")))
+            stats.pop("hit_rate")
+            for result, count in stats.items():
+                gauges.append(("sofia_answer_cache_total", {"result": result}, count))
+    except Exception as e:
+        print(f"DEBUG: No se pudieron leer las métricas del caché de respuestas: {e}")
+    try:
+        import persistence
+        if persistence._writer is not None:
+            gauges.append(("sofia_autosave_queue_depth", {}, persistence._writer.queue_depth()))
+    except Exception as e:
+        print(f"DEBUG: No se pudo leer la cola del auto-guardado: {e}")
+    return gauges
+
+def start_http_server(port=None, gauges=default_gauges, host=None):
+    """Sirve /metrics y /metrics.json en un hilo. Devuelve el servidor."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, content_type = prometheus_text(gauges()).encode("utf-8"), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host or METRICS_CONFIG["host"], port or METRICS_CONFIG["port"]), Handler)
+    threading.Thread(target=server.serve_forever, name="sofia-metrics", daemon=True).start()
+    return server
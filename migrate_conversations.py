@@ -0,0 +1,90 @@
+# migrate_conversations.py
+"""
+Migra el auto-guardado viejo (un documento completo por turno) al formato de un documento
+por sesión (_id = session_id, mensajes con número de secuencia).
+
+Para cada session_id toma la copia con más mensajes, la fusiona con el documento nuevo de la
+sesión si ya existe y borra las copias viejas. Como en el auto-guardado, updated_at lo pone el
+servidor (índice TTL y marca de agua de export_analytics.py) y cada mensaje lleva saved_at,
+que acá es el timestamp de la copia vieja elegida.
+
+Uso:
+    python migrate_conversations.py --dry-run
+    python migrate_conversations.py [--keep-old] [--batch-size 200]
+"""
+import argparse
+from settings import mongo_settings, open_mongo_client
+
+
+def legacy_sessions(collection):
+    """Agrupa los documentos viejos (con _id ObjectId) por session_id."""
+    sessions = {}
+    cursor = collection.find(
+        {"_id": {"$type": "objectId"}, "auto_saved": True},
+        {"session_id": 1, "topic": 1, "messages": 1, "timestamp": 1, "token_usage": 1},
+    )
+    for doc in cursor:
+        sessions.setdefault(doc.get("session_id", "unknown_session"), []).append(doc)
+    return sessions
+
+def merged_update(session_id, docs, existing):
+    """Arma la actualización para el documento de la sesión a partir de sus copias viejas."""
+    latest = max(docs, key=lambda d: (len(d.get("messages", [])), d.get("timestamp", "")))
+    created_at = min(d.get("timestamp", "") for d in docs)
+    existing_seqs = {m.get("seq") for m in (existing or {}).get("messages", [])}
+    saved_at = latest.get("timestamp", "")
+    messages = [dict(msg, seq=i, saved_at=msg.get("saved_at", saved_at))
+                for i, msg in enumerate(latest.get("messages", [])) if i not in existing_seqs]
+    update = {
+        "$setOnInsert": {"session_id": session_id, "auto_saved": True},
+        "$currentDate": {"updated_at": True},
+        "$min": {"created_at": created_at},
+        "$max": {"timestamp": latest.get("timestamp", ""), "message_count": len(latest.get("messages", []))},
+    }
+    if not existing:
+        update["$setOnInsert"]["topic"] = latest.get("topic")
+        if latest.get("token_usage"):
+            update["$setOnInsert"]["token_usage"] = latest["token_usage"]
+    if messages:
+        update["$push"] = {"messages": {"$each": messages, "$sort": {"seq": 1}}}
+    return update
+
+def migrate(collection, dry_run=False, keep_old=False, batch_size=200):
+    from pymongo import UpdateOne, DeleteMany
+    sessions = legacy_sessions(collection)
+    stats = {"sessions": len(sessions), "legacy_docs": sum(len(d) for d in sessions.values()), "deleted": 0}
+    session_ids = list(sessions)
+    for start in range(0, len(session_ids), batch_size):
+        chunk = session_ids[start:start + batch_size]
+        existing = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": chunk}}, {"messages.seq": 1})}
+        requests = [UpdateOne({"_id": sid}, merged_update(sid, sessions[sid], existing.get(sid)), upsert=True)
+                    for sid in chunk]
+        legacy_ids = [doc["_id"] for sid in chunk for doc in sessions[sid]]
+        if dry_run:
+            continue
+        collection.bulk_write(requests, ordered=False)
+        if not keep_old:
+            result = collection.bulk_write([DeleteMany({"_id": {"$in": legacy_ids}})])
+            stats["deleted"] += result.deleted_count
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Colapsa las copias del auto-guardado en un documento por sesión.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informa qué se migraría")
+    parser.add_argument("--keep-old", action="store_true", help="No borra los documentos viejos")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    settings = mongo_settings()
+    client = open_mongo_client(settings)
+    try:
+        collection = client[settings["db_name"]][settings["collection_name"]]
+        stats = migrate(collection, dry_run=args.dry_run, keep_old=args.keep_old, batch_size=args.batch_size)
+        prefix = "[dry-run] " if args.dry_run else ""
+        print(f"{prefix}{stats['legacy_docs']} documentos viejos en {stats['sessions']} sesiones; "
+              f"{stats['deleted']} borrados.")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
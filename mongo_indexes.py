@@ -0,0 +1,189 @@
+# mongo_indexes.py
+"""
+Índices de las colecciones de conversaciones, metadatos de PDFs y GridFS.
+
+`ensure_indexes` es idempotente: crea los que faltan, borra los que quedaron en desuso y,
+si cambió la retención, actualiza el TTL con collMod en lugar de recrear el índice. La app lo
+corre al arrancar (en un hilo) y también se puede correr a mano. `explain_report` ejecuta explain() sobre las consultas
+habituales e indica si usan un índice o recorren la colección completa.
+
+Uso:
+    python mongo_indexes.py ensure [--retention-days 180]
+    python mongo_indexes.py report
+"""
+import argparse
+from datetime import datetime, timedelta
+from chat_requests import TOPIC_CONFIG
+
+# Comparación sin distinguir mayúsculas (correos escritos a mano en el formulario)
+CASE_INSENSITIVE = {"locale": "es", "strength": 2}
+
+# Colección lógica -> [(campos, opciones)]. Las claves son las de [mongodb] en secrets.toml.
+INDEX_SPECS = {
+    "collection_name": [
+        # Las sesiones se buscan por _id (= session_id), que ya tiene índice
+        ([("timestamp", 1)], {"name": "timestamp"}),
+        ([("topic", 1), ("timestamp", -1)], {"name": "topic_timestamp"}),
+    ],
+    "pdf_metadata_collection": [
+        ([("email", 1), ("timestamp", -1)], {"name": "email_timestamp", "collation": CASE_INSENSITIVE}),
+        ([("session_id", 1)], {"name": "session_id"}),
+        ([("timestamp", 1)], {"name": "timestamp"}),
+        ([("topic", 1), ("timestamp", -1)], {"name": "topic_timestamp"}),
+        ([("pdf_gridfs_id", 1)], {"name": "pdf_gridfs_id"}),
+    ],
+    "gridfs_files": [
+        # El mismo índice que crea el driver de GridFS; se asegura aunque no se haya subido nada
+        ([("filename", 1), ("uploadDate", 1)], {"name": "filename_1_uploadDate_1"}),
+        ([("metadata.session_id", 1)], {"name": "metadata_session_id"}),
+    ],
+    "gridfs_chunks": [
+        ([("files_id", 1), ("n", 1)], {"name": "files_id_1_n_1", "unique": True}),
+    ],
+}
+
+# Índices que ya no se usan: se borran si existen (cada uno cuesta en cada escritura)
+OBSOLETE_INDEXES = {
+    "collection_name": ["session_id"],
+}
+
+# Retención de las conversaciones auto-guardadas (updated_at es una fecha BSON)
+TTL_INDEX = {"logical": "collection_name", "field": "updated_at", "name": "ttl_updated_at"}
+
+
+def collection_names(settings):
+    """Colección lógica -> nombre real, según la configuración de Mongo."""
+    prefix = settings.get("gridfs_prefix", "pdfs")
+    return {
+        "collection_name": settings.get("collection_name"),
+        "pdf_metadata_collection": settings.get("pdf_metadata_collection"),
+        "gridfs_files": f"{prefix}.files",
+        "gridfs_chunks": f"{prefix}.chunks",
+    }
+
+def ensure_ttl_index(collection, retention_days):
+    """Crea, ajusta o informa el índice TTL. Devuelve la acción realizada."""
+    existing = collection.index_information().get(TTL_INDEX["name"])
+    if not retention_days:
+        return "ttl: sin retención configurada" + (" (el índice existente se mantiene)" if existing else "")
+    seconds = int(float(retention_days) * 86400)  # Puede venir como texto de una variable de entorno
+    if existing is None:
+        collection.create_index([(TTL_INDEX["field"], 1)], name=TTL_INDEX["name"], expireAfterSeconds=seconds)
+        return f"ttl: creado ({retention_days} días)"
+    if existing.get("expireAfterSeconds") != seconds:
+        collection.database.command("collMod", collection.name,
+                                    index={"name": TTL_INDEX["name"], "expireAfterSeconds": seconds})
+        return f"ttl: actualizado a {retention_days} días"
+    return "ttl: sin cambios"
+
+def ensure_indexes(db, settings, retention_days=None):
+    """Crea los índices que faltan. Devuelve {colección: [nombres creados o acciones]}."""
+    from pymongo import IndexModel
+    names = collection_names(settings)
+    results = {}
+    for logical, specs in INDEX_SPECS.items():
+        if not names.get(logical):
+            continue
+        collection = db[names[logical]]
+        existing = set(collection.index_information())
+        missing = [IndexModel(keys, **options) for keys, options in specs if options["name"] not in existing]
+        results[names[logical]] = collection.create_indexes(missing) if missing else []
+        for name in OBSOLETE_INDEXES.get(logical, []):
+            if name in existing:
+                collection.drop_index(name)
+                results[names[logical]].append(f"{name}: borrado")
+    if names.get(TTL_INDEX["logical"]):
+        collection = db[names[TTL_INDEX["logical"]]]
+        results.setdefault(collection.name, []).append(ensure_ttl_index(collection, retention_days))
+    return results
+
+
+# --- Reporte de planes de consulta ---
+
+def standard_queries(settings):
+    """Consultas habituales de la app y de los scripts: (colección lógica, descripción, filtro, orden, collation)."""
+    since = (datetime.now() - timedelta(days=7)).date().isoformat()
+    topic = next(name for name in TOPIC_CONFIG if name != "default")  # Un tema real, con documentos
+    return [
+        # Lo cubre el índice TTL (no se crea otro índice sobre updated_at: chocaría con él)
+        ("collection_name", "exportación incremental por updated_at",
+         {"updated_at": {"$gt": datetime.now() - timedelta(days=7)}}, None, None),
+        ("collection_name", "últimas sesiones de un tema", {"topic": topic}, [("timestamp", -1)], None),
+        ("pdf_metadata_collection", "PDFs de un correo", {"email": "ejemplo@correo.com"}, [("timestamp", -1)], CASE_INSENSITIVE),
+        ("pdf_metadata_collection", "PDFs de una sesión", {"session_id": "ejemplo"}, None, None),
+        ("pdf_metadata_collection", "PDFs por rango de fechas", {"timestamp": {"$gte": since}}, None, None),
+        ("pdf_metadata_collection", "PDFs de un tema y fechas", {"topic": topic, "timestamp": {"$gte": since}}, None, None),
+        ("gridfs_files", "archivo por nombre", {"filename": "ejemplo.pdf"}, None, None),
+    ]
+
+def plan_stages(plan):
+    """Recorre el árbol del plan ganador y devuelve (etapas, índices usados)."""
+    stages, indexes = [], []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        pending.extend(node.get("inputStages", []))
+        for key in ("inputStage", "queryPlan"):
+            if key in node:
+                pending.append(node[key])
+    return stages, indexes
+
+def explain_report(db, settings):
+    """Ejecuta explain() de cada consulta habitual y devuelve una fila por consulta."""
+    names = collection_names(settings)
+    rows = []
+    for logical, description, filter_, sort, collation in standard_queries(settings):
+        if not names.get(logical):
+            continue
+        cursor = db[names[logical]].find(filter_)
+        if sort:
+            cursor = cursor.sort(sort)
+        if collation:
+            cursor = cursor.collation(collation)
+        explanation = cursor.explain()
+        stages, indexes = plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        stats = explanation.get("executionStats", {})
+        rows.append({
+            "collection": names[logical], "query": description,
+            "uses_index": "COLLSCAN" not in stages and bool(indexes),
+            "indexes": indexes, "stages": stages,
+            "docs_examined": stats.get("totalDocsExamined"), "returned": stats.get("nReturned"),
+        })
+    return rows
+
+
+def main():
+    from settings import mongo_settings, open_mongo_client
+    parser = argparse.ArgumentParser(description="Índices de MongoDB de SofIA.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = subcommands.add_parser("ensure", help="Crea los índices que faltan")
+    ensure_parser.add_argument("--retention-days", type=float,
+                               help="Días que se conservan las conversaciones auto-guardadas (TTL)")
+    subcommands.add_parser("report", help="Muestra si las consultas habituales usan índices")
+    args = parser.parse_args()
+
+    settings = mongo_settings()
+    client = open_mongo_client(settings)
+    try:
+        db = client[settings["db_name"]]
+        if args.command == "ensure":
+            retention_days = args.retention_days or settings.get("conversation_retention_days")
+            for collection, actions in ensure_indexes(db, settings, retention_days).items():
+                print(f"{collection}: {', '.join(actions) if actions else 'sin cambios'}")
+        else:
+            for row in explain_report(db, settings):
+                status = "OK " if row["uses_index"] else "SCAN"
+                print(f"[{status}] {row['collection']}: {row['query']} -> "
+                      f"{', '.join(row['indexes']) or '-'} ({' > '.join(row['stages'])}; "
+                      f"examinados {row['docs_examined']}, devueltos {row['returned']})")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
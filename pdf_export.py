@@ -0,0 +1,312 @@
+# pdf_export.py
+"""
+Generación del PDF de la conversación fuera del script de Streamlit.
+
+El HTML se arma y se renderiza con xhtml2pdf en un pool de procesos (spawn), así la UI
+no se congela. La cabecera con el CSS y los logos reducidos y codificados en Base64 se
+arman una sola vez por proceso. El PDF se escribe en memoria (o en un archivo temporal
+anónimo si supera el umbral) y el mismo proceso lo sube a GridFS con open_upload_stream,
+junto con los metadatos, en una transacción. La barra lateral consulta el estado por id.
+"""
+import os
+import io
+import time
+import uuid
+import shutil
+import tempfile
+import base64
+import threading
+import functools
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PRIMARY_COLOR = "#4b83c0"
+SECONDARY_COLOR = "#878889"
+BACKGROUND_COLOR = "#ffffff"
+ICOMEX_LOGO_PATH = "logos/ICOMEX_Logos sin fondo.png"
+SOFIA_AVATAR_PATH = "logos/sofia_avatar.png"
+
+PDF_CONFIG = {
+    "workers": 1,               # Procesos de renderizado (acota la memoria pico)
+    "max_tasks_per_child": 20,  # Reciclar el proceso cada N PDFs para liberar memoria
+    "max_pending": 8,           # Trabajos en cola o en curso antes de rechazar nuevos
+    "logo_height_px": 90,       # 2x la altura con la que se muestran en el PDF (45px)
+    "max_finished_jobs": 200,   # Estados terminados que se conservan para consulta
+    "spool_max_bytes": 4 * 1024 * 1024,     # Hasta este tamaño el PDF queda en memoria
+    "gridfs_chunk_size": 1024 * 1024,       # Un solo chunk para la mayoría de los PDFs
+    "legacy_dir_max_age": 24 * 3600,        # Antigüedad para borrar carpetas conv_pdf_* viejas
+}
+
+# Código de MongoDB cuando el servidor no admite transacciones (standalone)
+ILLEGAL_OPERATION = 20
+
+PDF_HEAD_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        @page {{ margin: 2cm; }}
+        body {{ font-family: Arial, sans-serif; line-height: 1.4; background-color: {background}; margin: 0; padding: 0; font-size: 10pt; color: #333;}}
+        .logos-container {{ width: 100%; text-align: center; margin-bottom: 15px; border-bottom: 1px solid #eee; padding-bottom: 10px;}}
+        .logos-container table {{ margin: 0 auto; border-collapse: collapse; }}
+        .logos-container img {{ vertical-align: middle; height: 45px; max-width: 120px; margin: 0 8px; }}
+        .title-container {{ text-align: center; margin-bottom: 20px; }}
+        .title-container h1 {{ color: {primary}; font-size: 14pt; margin: 5px 0; font-weight: bold; }}
+        .content {{ margin: 0; padding: 0; }}
+        .info p {{ margin: 2px 0; font-size: 9pt; }}
+        .messages h2 {{ font-size: 12pt; color: {primary}; border-bottom: 1px solid #eee; padding-bottom: 3px; margin-top: 15px; margin-bottom: 10px;}}
+        .user b {{ color: {secondary}; }}
+        .assistant b {{ color: {primary}; }}
+        .message {{ margin-bottom: 0.8em; padding-left: 5px; border-left: 2px solid #eee;}}
+        .message.user {{ border-left-color: {secondary}; }}
+        .message.assistant {{ border-left-color: {primary}; }}
+        .message b {{ display: inline-block; width: 80px; font-weight: bold; vertical-align: top; padding-right: 5px;}}
+        .message div {{ display: inline-block; width: auto; vertical-align: top; word-wrap: break-word; }}
+    </style>
+</head>
+<body>
+    <div class="logos-container">
+        <table>
+            <tr>
+                <td style="text-align: center;">
+                    <img src="data:image/png;base64,{sofia_logo}" alt="SofIA Logo">
+                    <img src="data:image/png;base64,{icomex_logo}" alt="ICOMEX Logo">
+                </td>
+            </tr>
+        </table>
+    </div>
+"""
+
+
+# --- Lado del proceso de renderizado ---
+
+@functools.lru_cache(maxsize=None)
+def encoded_logo(image_path, height_px):
+    """Logo reducido a `height_px` de alto, en PNG y Base64 (una vez por proceso)."""
+    from PIL import Image
+    try:
+        with Image.open(os.path.join(SCRIPT_DIR, image_path)) as image:
+            image.thumbnail((height_px * 4, height_px))
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+        return base64.b64encode(buffer.getvalue()).decode("ascii")
+    except (OSError, ValueError) as e:
+        print(f"DEBUG: No se pudo preparar el logo {image_path}: {e}")
+        return ""
+
+@functools.lru_cache(maxsize=1)
+def html_head():
+    """CSS y cabecera con logos, armados una sola vez por proceso."""
+    height = PDF_CONFIG["logo_height_px"]
+    return PDF_HEAD_TEMPLATE.format(
+        background=BACKGROUND_COLOR, primary=PRIMARY_COLOR, secondary=SECONDARY_COLOR,
+        sofia_logo=encoded_logo(SOFIA_AVATAR_PATH, height), icomex_logo=encoded_logo(ICOMEX_LOGO_PATH, height),
+    )
+
+def build_conversation_html(topic, name, last_name, email, date_display, messages):
+    from text_normalizer import normalize_for_pdf
+    html_parts = [html_head(), f"""
+    <div class="title-container">
+        <h1>{topic}</h1>
+        <h1>Conversación de {name.title()} con SofIA</h1>
+    </div>
+    <div class="content">
+        <div class="info">
+            <p><b>Nombre:</b> {name.title()} {last_name.title()}</p>
+            <p><b>Correo:</b> {email}</p>
+            <p><b>Fecha:</b> {date_display} hs</p>
+        </div>
+        <div class="messages">
+            <h2>Mensajes</h2>
+    """]
+    for msg in messages:
+        role_display_name = name.title() if msg["role"] == "user" else "SofIA"
+        cleaned_content = normalize_for_pdf(msg["content"])
+        html_parts.append(f"<div class='message {msg['role']}'><b>{role_display_name}:</b> <div>{cleaned_content}</div></div>")
+    html_parts.append("</div></div></body></html>")
+    return "\n".join(html_parts)
+
+def generate_pdf(html_content, dest):
+    """Genera el PDF a partir de HTML (UTF-8) en un objeto tipo archivo."""
+    from xhtml2pdf import pisa
+    try:
+        pisa_status = pisa.CreatePDF(html_content, dest=dest, encoding='UTF-8')
+        if pisa_status.err:
+            return False, f"Error de pisa ({pisa_status.err})"
+        return True, None
+    except Exception as e:
+        return False, f"Excepción al generar PDF: {e}"
+
+_worker_client = None
+
+def worker_mongo_client(mongo_settings):
+    """MongoClient del proceso de renderizado, creado una vez y reutilizado."""
+    global _worker_client
+    if _worker_client is None:
+        from settings import open_mongo_client
+        _worker_client = open_mongo_client(mongo_settings, maxPoolSize=2)
+    return _worker_client
+
+def _upload_pdf(bucket, payload, pdf_file, session=None):
+    """Copia el PDF a GridFS por chunks con open_upload_stream y devuelve el id del archivo."""
+    metadata = payload["metadata"]
+    pdf_file.seek(0)
+    with bucket.open_upload_stream(
+        payload["pdf_filename"],
+        metadata={
+            "contentType": "application/pdf",
+            "email": metadata["email"], "topic": metadata["topic"],
+            "session_id": metadata["session_id"],
+            "submitter_name": f"{metadata['name']} {metadata['last_name']}",
+        },
+        session=session,
+    ) as grid_in:
+        shutil.copyfileobj(pdf_file, grid_in, PDF_CONFIG["gridfs_chunk_size"])
+    return grid_in._id
+
+def _insert_metadata(db, payload, file_id, session=None):
+    metadata_to_save = dict(payload["metadata"], pdf_gridfs_id=file_id)
+    db[payload["metadata_collection"]].insert_one(metadata_to_save, session=session)
+
+def store_pdf(payload, pdf_file):
+    """
+    Sube el PDF y guarda los metadatos como una unidad: en una transacción si el servidor
+    la admite; si no (mongod standalone), borrando el archivo cuando fallan los metadatos.
+    """
+    from gridfs import GridFSBucket
+    from pymongo.errors import OperationFailure
+    client = worker_mongo_client(payload["mongo"])
+    db = client[payload["mongo"]["db_name"]]
+    bucket = GridFSBucket(db, bucket_name=payload["gridfs_prefix"],
+                          chunk_size_bytes=PDF_CONFIG["gridfs_chunk_size"])
+
+    def write(session):
+        _insert_metadata(db, payload, _upload_pdf(bucket, payload, pdf_file, session), session)
+
+    try:
+        with client.start_session() as session:
+            session.with_transaction(write)
+        return
+    except OperationFailure as e:
+        if e.code != ILLEGAL_OPERATION:
+            raise
+        print("DEBUG: El servidor no admite transacciones; se guarda el PDF sin transacción.")
+    file_id = _upload_pdf(bucket, payload, pdf_file)
+    try:
+        _insert_metadata(db, payload, file_id)
+    except Exception:
+        bucket.delete(file_id)
+        raise
+
+def render_job(payload):
+    """
+    Se ejecuta en el proceso de renderizado: arma el HTML, genera el PDF sin pasar por
+    disco (salvo que supere spool_max_bytes) y lo guarda en MongoDB.
+    Devuelve un mensaje de error o None.
+    """
+    html_content = build_conversation_html(
+        payload["topic"], payload["name"], payload["last_name"], payload["email"],
+        payload["date_display"], payload["messages"],
+    )
+    with tempfile.SpooledTemporaryFile(max_size=PDF_CONFIG["spool_max_bytes"], mode="w+b") as pdf_file:
+        ok, error = generate_pdf(html_content, pdf_file)
+        del html_content
+        if not ok:
+            return f"Error crítico al generar el archivo PDF: {error}"
+        try:
+            store_pdf(payload, pdf_file)
+        except Exception as e:
+            return f"Error al guardar la conversación en MongoDB: {e}"
+    return None
+
+def cleanup_legacy_pdf_dirs(max_age=None):
+    """Borra las carpetas conv_pdf_<sesión> que dejaba la versión anterior en el directorio temporal."""
+    max_age = PDF_CONFIG["legacy_dir_max_age"] if max_age is None else max_age
+    temp_dir = tempfile.gettempdir()
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(temp_dir):
+        path = os.path.join(temp_dir, name)
+        if name.startswith("conv_pdf_") and os.path.isdir(path):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+# --- Lado de la app: cola de trabajos y estado ---
+
+_lock = threading.Lock()
+_jobs = {}
+_render_pool = None
+
+
+def _pool():
+    global _render_pool
+    if _render_pool is None:
+        # Import diferido: solo hace falta cuando alguien pide el primer PDF
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        _render_pool = ProcessPoolExecutor(
+            max_workers=PDF_CONFIG["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=PDF_CONFIG["max_tasks_per_child"],
+        )
+    return _render_pool
+
+def _discard_pool(render_pool):
+    """Descarta un pool roto (murió un proceso o quedó cerrado); el próximo pedido crea uno nuevo."""
+    global _render_pool
+    with _lock:
+        if _render_pool is render_pool:
+            _render_pool = None
+    try:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+    except Exception as e:
+        print(f"DEBUG: No se pudo cerrar el pool de PDF: {e}")
+
+def _set_status(job_id, status, message=None):
+    with _lock:
+        _jobs[job_id].update(status=status, message=message)
+        finished = [jid for jid, job in _jobs.items() if job["status"] in ("done", "error")]
+        for jid in finished[:-PDF_CONFIG["max_finished_jobs"]]:
+            del _jobs[jid]
+
+def submit_pdf_job(payload):
+    """Encola el PDF y devuelve el id del trabajo, o None si hay demasiados trabajos pendientes."""
+    with _lock:
+        pending = sum(1 for job in _jobs.values() if job["status"] not in ("done", "error"))
+        if pending >= PDF_CONFIG["max_pending"]:
+            return None
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {"status": "rendering", "message": None}
+        render_pool = _pool()
+
+    def on_finished(future):
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            error = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _discard_pool(render_pool)
+            error = f"Se produjo un error inesperado durante el proceso de guardado: {e}"
+        _set_status(job_id, "error" if error else "done", error)
+
+    try:
+        future = render_pool.submit(render_job, payload)
+    except Exception as e:
+        # BrokenProcessPool o pool cerrado: el trabajo no ocupa lugar y el pool se recrea
+        print(f"DEBUG: No se pudo encolar el PDF: {e}")
+        _discard_pool(render_pool)
+        _set_status(job_id, "error", f"No se pudo iniciar la generación del PDF, intente de nuevo: {e}")
+        return job_id
+    future.add_done_callback(on_finished)
+    return job_id
+
+def job_status(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
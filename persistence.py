@@ -0,0 +1,197 @@
+# persistence.py
+"""
+Escritor en segundo plano para el auto-guardado de conversaciones.
+
+Las escrituras se encolan (cola acotada) y un hilo del proceso las agrupa con bulk_write,
+reintentando con backoff exponencial. Si MongoDB no responde, las operaciones se guardan
+en un journal local (JSON extendido, una por línea) que se reproduce al iniciar el escritor
+y cada vez que Mongo vuelve a responder. El turno del chat nunca espera a la persistencia.
+"""
+import os
+import time
+import queue
+import random
+import atexit
+import threading
+
+WRITER_CONFIG = {
+    "queue_size": 1000,
+    "batch_size": 50,
+    "flush_interval": 1.0,     # Segundos que se espera para juntar un lote
+    "max_retries": 4,
+    "backoff_base": 0.5,
+    "backoff_max": 15.0,
+    "journal_path": os.environ.get(
+        "SOFIA_AUTOSAVE_JOURNAL",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "autosave_journal.jsonl"),
+    ),
+}
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class BackgroundWriter:
+    """Hilo que drena la cola de operaciones y las escribe en MongoDB por lotes."""
+
+    def __init__(self, get_db, reset_db=None):
+        self._get_db = get_db
+        self._reset_db = reset_db
+        self._queue = queue.Queue(maxsize=WRITER_CONFIG["queue_size"])
+        self._journal_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="sofia-autosave", daemon=True)
+        self.stats = {"enqueued": 0, "written": 0, "spilled": 0, "replayed": 0, "failed_batches": 0}
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self._spill_pending)
+
+    def enqueue(self, operation):
+        """Encola una operación sin bloquear; si la cola está llena va directo al journal."""
+        try:
+            self._queue.put_nowait(operation)
+            self.stats["enqueued"] += 1
+        except queue.Full:
+            self._append_journal([operation])
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    # --- Bucle principal ---
+
+    def _run(self):
+        self._safe_replay()
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                if self._write_with_retry(batch):
+                    self.stats["written"] += len(batch)
+                    self._safe_replay()
+                else:
+                    self._append_journal(batch)
+            except Exception as e:
+                # El hilo no debe morir: cualquier error inesperado deja el lote en el journal
+                print(f"DEBUG: Error inesperado en el escritor en segundo plano: {e}")
+                self._append_journal(batch)
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=WRITER_CONFIG["flush_interval"])]
+        except queue.Empty:
+            return []
+        while len(batch) < WRITER_CONFIG["batch_size"]:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_with_retry(self, batch):
+        for attempt in range(WRITER_CONFIG["max_retries"]):
+            try:
+                self._write(batch)
+                return True
+            except Exception as e:
+                print(f"DEBUG: Falló la escritura en segundo plano (intento {attempt + 1}): {e}")
+                if self._reset_db and is_connection_error(e):
+                    self._reset_db()
+                delay = min(WRITER_CONFIG["backoff_max"], WRITER_CONFIG["backoff_base"] * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        self.stats["failed_batches"] += 1
+        return False
+
+    def _write(self, batch):
+        from pymongo.errors import BulkWriteError
+        db = self._get_db()
+        by_collection = {}
+        for operation in batch:
+            by_collection.setdefault(operation["collection"], []).append(to_pymongo(operation))
+        for collection_name, requests in by_collection.items():
+            try:
+                db[collection_name].bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                # Los duplicados vienen de reintentos de inserciones que ya se aplicaron
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+
+    # --- Journal local ---
+
+    def _append_journal(self, operations):
+        from bson import json_util
+        with self._journal_lock:
+            with open(WRITER_CONFIG["journal_path"], "a", encoding="utf-8") as journal:
+                for operation in operations:
+                    journal.write(json_util.dumps(operation) + "\n")
+        self.stats["spilled"] += len(operations)
+
+    def _safe_replay(self):
+        try:
+            self._replay_journal()
+        except Exception as e:
+            print(f"DEBUG: No se pudo reproducir el journal de auto-guardado: {e}")
+
+    def _replay_journal(self):
+        """Reescribe en Mongo las operaciones pendientes del journal, si las hay."""
+        from bson import json_util
+        path = WRITER_CONFIG["journal_path"]
+        replay_path = f"{path}.replaying"
+        with self._journal_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(path):
+                    return
+                os.replace(path, replay_path)
+        with open(replay_path, "r", encoding="utf-8") as journal:
+            operations = [json_util.loads(line) for line in journal if line.strip()]
+        size = WRITER_CONFIG["batch_size"]
+        for start in range(0, len(operations), size):
+            batch = operations[start:start + size]
+            if not self._write_with_retry(batch):
+                self._append_journal(operations[start:])
+                break
+            self.stats["replayed"] += len(batch)
+        os.remove(replay_path)
+
+    def _spill_pending(self):
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            self._append_journal(pending)
+
+
+def is_connection_error(error):
+    from pymongo.errors import ConnectionFailure
+    return isinstance(error, ConnectionFailure)
+
+def to_pymongo(operation):
+    from pymongo import InsertOne, UpdateOne
+    if operation["op"] == "insert":
+        return InsertOne(operation["document"])
+    if operation["op"] == "update":
+        return UpdateOne(operation["filter"], operation["update"], upsert=operation.get("upsert", False))
+    raise ValueError(f"Operación desconocida: {operation['op']}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Escritor único del proceso; se crea e inicia la primera vez que se usa."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            import clients
+            _writer = BackgroundWriter(clients.get_mongo_db, clients.reset_mongo_client)
+            _writer.start()
+        return _writer
+
+def enqueue_update(collection_name, filter_, update, upsert=True):
+    """Encola una actualización (por defecto con upsert)."""
+    get_writer().enqueue({
+        "collection": collection_name, "op": "update", "filter": filter_, "update": update, "upsert": upsert,
+    })
@@ -0,0 +1,203 @@
+# prefetch.py
+"""
+Precalentamiento al elegir un tema, mientras se escribe el saludo.
+
+La primera pregunta de una sesión pagaba varios costos en frío a la vez: cargar y tokenizar
+las instrucciones, crear los clientes, abrir las conexiones (DNS/TLS) a OpenAI y Mongo y,
+del lado del proveedor, el caché de prompts vacío. `start` corre esos pasos en un pool del
+proceso; opcionalmente (SOFIA_PREFETCH_PRIMER=1) envía además un pedido mínimo con el
+prefijo fijo del tema para que el proveedor lo tenga en caché.
+
+Cada precalentamiento se puede cancelar: los pasos que no empezaron no se ejecutan (el que
+está en curso termina). La primera pregunta cancela el de su sesión, pero si el primer ya
+estaba en vuelo corre en paralelo con el pedido real, que en ese caso no aprovecha el caché
+del proveedor (se etiqueta "partial"). Los pasos que calientan recursos compartidos (conexiones, primer) se
+saltean si otra sesión ya los hizo hace poco. Con SOFIA_PREFETCH_HOLDOUT se deja una
+fracción de sesiones sin precalentar, para comparar la latencia del primer turno.
+"""
+import os
+import time
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+import knowledge_base
+import chat_requests
+import clients
+import upstream
+
+PREFETCH_CONFIG = {
+    "enabled": os.environ.get("SOFIA_PREFETCH", "1") != "0",
+    "holdout": float(os.environ.get("SOFIA_PREFETCH_HOLDOUT", "0")),  # Fracción de sesiones de control
+    "primer": os.environ.get("SOFIA_PREFETCH_PRIMER") == "1",   # Opt-in: cuesta un pedido por tema
+    "primer_interval": 300.0,       # Segundos entre primers del mismo prefijo (dura lo que el caché del proveedor)
+    "connection_interval": 30.0,    # Segundos durante los que una conexión recién abierta se da por caliente
+    "request_timeout": 5.0,
+    "workers": 4,
+}
+
+PRIMER_QUESTION = "Hola"
+
+# Estado del precalentamiento al llegar la primera pregunta -> sufijo de la métrica first_turn_ttft
+FIRST_TURN_LABELS = {"done": "warm", "running": "partial", "pending": "partial", "cancelled": "partial", "off": "cold"}
+
+_executor = None
+_executor_lock = threading.Lock()
+_last_run = {}             # Paso compartido -> momento en que se ejecutó por última vez
+_last_run_lock = threading.Lock()
+_counters = Counter()
+
+
+def get_executor():
+    """Pool de hilos compartido por el proceso para los precalentamientos."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_CONFIG["workers"], thread_name_prefix="sofia-prefetch")
+        return _executor
+
+def claim(key, interval):
+    """True si el paso compartido `key` no se ejecutó en los últimos `interval` segundos (y lo reserva)."""
+    now = time.monotonic()
+    with _last_run_lock:
+        if now - _last_run.get(key, float("-inf")) < interval:
+            return False
+        _last_run[key] = now
+        return True
+
+def release(key):
+    """Libera la reserva de un paso que falló, así otra sesión puede intentarlo enseguida."""
+    with _last_run_lock:
+        _last_run.pop(key, None)
+
+def _count(key):
+    with _last_run_lock:
+        _counters[key] += 1
+
+
+class Prefetch:
+    """Precalentamiento de una sesión para un tema."""
+
+    def __init__(self, topic, audio=False):
+        self.topic = topic
+        self.audio = audio
+        self.status = "pending"    # pending, running, done, cancelled
+        self.steps = {}            # paso -> (resultado, segundos)
+        self.version_id = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Evita los pasos que todavía no empezaron (el que está en curso, incluso el primer, termina)."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        self.status = "running"
+        steps = [("instructions", self._instructions), ("openai", self._openai), ("mongo", self._mongo),
+                 ("elevenlabs", self._elevenlabs), ("primer", self._primer)]
+        for name, step in steps:
+            if self.cancelled:
+                self.status = "cancelled"
+                _count("cancelled")
+                return self
+            start = time.perf_counter()
+            try:
+                result = step()
+            except Exception as e:
+                result = f"error: {e}"
+                _count("errors")
+                print(f"DEBUG: Falló el precalentamiento ({name}) de {self.topic}: {e}")
+            self.steps[name] = (result, time.perf_counter() - start)
+        self.status = "done"
+        _count("done")
+        return self
+
+    def _instructions(self):
+        # Carga y tokeniza la versión vigente (y el encoding de tiktoken, la primera vez)
+        version = knowledge_base.current_version(self.topic)
+        self.version_id = version.version_id
+        return f"{version.version_id} ({version.fixed_token_count} tokens fijos)"
+
+    def _openai(self):
+        if not upstream.available("openai"):
+            return "no disponible"
+        if not claim("openai", PREFETCH_CONFIG["connection_interval"]):
+            return "reciente"
+        # Una consulta gratuita abre la conexión (DNS + TLS) que queda en el pool keep-alive
+        try:
+            client = clients.get_openai_client().with_options(timeout=PREFETCH_CONFIG["request_timeout"])
+            client.models.retrieve(chat_requests.get_topic_config(self.topic)["model"])
+        except Exception:
+            release("openai")
+            raise
+        return "conectado"
+
+    def _mongo(self):
+        if "mongodb" not in st.secrets:
+            return "sin configurar"
+        if not claim("mongo", PREFETCH_CONFIG["connection_interval"]):
+            return "reciente"
+        try:
+            clients.get_mongo_db().command("ping")
+        except Exception:
+            release("mongo")
+            raise
+        return "conectado"
+
+    def _elevenlabs(self):
+        if not self.audio:
+            return "audio apagado"
+        clients.get_elevenlabs_client()  # Solo crear el cliente: importa el SDK
+        return "cliente creado"
+
+    def _primer(self):
+        if not PREFETCH_CONFIG["primer"]:
+            return "desactivado"
+        version = knowledge_base.current_version(self.topic)
+        if not upstream.available("openai"):
+            return "no disponible"
+        key = ("primer", self.topic, version.version_id)
+        if not claim(key, PREFETCH_CONFIG["primer_interval"]):
+            return "reciente"
+        # Mismo prefijo que los pedidos reales (instrucciones primero), con un solo token de salida
+        instructions = version.prompt_text
+        request = chat_requests.build_request(self.topic, [{"role": "user", "content": PRIMER_QUESTION}],
+                                              instructions, stream=False)
+        request["max_tokens"] = 1
+        try:
+            response = upstream.call("openai", clients.get_openai_client().chat.completions.create, **request)
+        except Exception:
+            release(key)
+            raise
+        chat_requests.record_usage(self.topic, request["model"], getattr(response, "usage", None),
+                                   chat_requests.prefix_hash(instructions))
+        _count("primers")
+        return "enviado"
+
+
+def start(topic, audio=False):
+    """
+    Inicia el precalentamiento en segundo plano y lo devuelve, o None si está apagado o si la
+    sesión quedó en el grupo de control.
+    """
+    if not PREFETCH_CONFIG["enabled"]:
+        return None
+    if random.random() < PREFETCH_CONFIG["holdout"]:
+        _count("holdout")
+        return None
+    job = Prefetch(topic, audio)
+    _count("started")
+    get_executor().submit(job.run)
+    return job
+
+def state(job):
+    """Estado para etiquetar las métricas del primer turno: off, pending, running, done o cancelled."""
+    return job.status if job is not None else "off"
+
+def stats():
+    with _last_run_lock:
+        return dict(_counters)
@@ -0,0 +1,62 @@
+# settings.py
+"""
+Configuración de MongoDB para los scripts de línea de comandos (fuera de Streamlit).
+
+Toma los valores de variables de entorno y, si faltan, de .streamlit/secrets.toml
+(sección [mongodb]), igual que la app.
+"""
+import os
+import tomllib
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRETS_PATH = os.path.join(SCRIPT_DIR, ".streamlit", "secrets.toml")
+
+# Clave en secrets.toml -> variable de entorno
+MONGO_ENV_VARS = {
+    "uri": "MONGODB_URI",
+    "db_name": "MONGODB_DB_NAME",
+    "collection_name": "MONGODB_COLLECTION",
+    "pdf_metadata_collection": "MONGODB_PDF_METADATA_COLLECTION",
+    "gridfs_prefix": "MONGODB_GRIDFS_PREFIX",
+    "conversation_retention_days": "MONGODB_CONVERSATION_RETENTION_DAYS",
+    "tls": "MONGODB_TLS",
+}
+
+
+def load_secrets(path=SECRETS_PATH):
+    try:
+        with open(path, "rb") as file:
+            return tomllib.load(file)
+    except FileNotFoundError:
+        return {}
+
+def mongo_settings(secrets_path=SECRETS_PATH):
+    """Devuelve la configuración de Mongo; las variables de entorno tienen prioridad."""
+    settings = dict(load_secrets(secrets_path).get("mongodb", {}))
+    for key, env_var in MONGO_ENV_VARS.items():
+        if os.environ.get(env_var):
+            settings[key] = os.environ[env_var]
+    missing = [key for key in ("uri", "db_name") if not settings.get(key)]
+    if missing:
+        raise KeyError(f"Faltan valores de configuración de MongoDB: {', '.join(missing)} "
+                       f"(variables {', '.join(MONGO_ENV_VARS[k] for k in missing)} o {secrets_path})")
+    return settings
+
+def tls_enabled(settings):
+    """TLS está activado salvo que se desactive a propósito (tls = false o MONGODB_TLS=0)."""
+    return str(settings.get("tls", True)).strip().lower() not in ("0", "false", "no", "off")
+
+def open_mongo_client(settings, **kwargs):
+    """
+    Crea un MongoClient con la misma configuración que la app: TLS con los certificados de
+    certifi y Server API 1. Solo un mongod local de pruebas (bench_load.py) va sin TLS, y
+    únicamente si se pide con `tls = false` en [mongodb] o MONGODB_TLS=0.
+    """
+    from pymongo import MongoClient
+    if tls_enabled(settings):
+        from pymongo.server_api import ServerApi
+        import certifi
+        kwargs.setdefault("tls", True)
+        kwargs.setdefault("tlsCAFile", certifi.where())
+        kwargs.setdefault("server_api", ServerApi('1'))
+    return MongoClient(settings["uri"], **kwargs)
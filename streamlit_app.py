@@ -1,12 +1,23 @@
 import streamlit as st
 import frontend
-from openai import OpenAI
-from PIL import Image
 import sidebar
-import tempfile
+import knowledge_base
+import chat_requests
+import conversation_history
+import clients
+import persistence
+import pdf_export
+import mongo_indexes
+import answer_cache
+import upstream
+import metrics
+import tts
+import assets
+import prefetch
 from sidebar import clean_message_for_audio
-from elevenlabs import ElevenLabs
 import uuid
+import time
+import threading
 
 # Generar un identificador único si no existe ya
 if "session_id" not in st.session_state:
@@ -20,18 +31,108 @@ BACKGROUND_COLOR = "#ffffff"
 ICOMEX_LOGO_PATH = "logos/ICOMEX_Logos sin fondo.png"
 SOFIA_AVATAR_PATH = "logos/sofia_avatar.png"
 USER_LOGO_PATH = "logos/user_avatar.png"
-st.set_page_config(page_title="SofIA - Asesora Virtual", layout="centered", page_icon=SOFIA_AVATAR_PATH)
+st.set_page_config(page_title="SofIA - Asesora Virtual", layout="centered",
+                   page_icon=assets.variant_path(SOFIA_AVATAR_PATH, "icon"))
 
 # Inicializar estilos personalizados
 frontend.render_custom_styles()
 
-# Cachear las imágenes
-@st.cache_data
-def load_image(image_path):
-    return Image.open(image_path)
+# Avatares como bytes PNG, leídos una vez por proceso: cada burbuja los referencia sin
+# volver a codificar la imagen en cada rerun
+@st.cache_resource
+def load_avatar(image_path):
+    with open(image_path, "rb") as file:
+        return file.read()
+
+sofia_logo = load_avatar(assets.variant_path(SOFIA_AVATAR_PATH, "avatar"))
+user_logo = load_avatar(assets.variant_path(USER_LOGO_PATH, "avatar"))
+
+# Trabajo de arranque que la primera página no necesita: cargar los conocimientos de cada tema
+# (se recargan solos si cambia el .txt) y regenerar las variantes de logos/ si quedaron viejas
+@st.cache_resource
+def start_warmup():
+    def run():
+        for topic in knowledge_base.INSTRUCTIONS_FILES:
+            try:
+                knowledge_base.current_version(topic)
+            except Exception as e:
+                print(f"DEBUG: No se pudieron cargar los conocimientos de {topic}: {e}")
+        try:
+            assets.build_variants()
+        except Exception as e:
+            print(f"DEBUG: No se pudieron generar las variantes de los logos: {e}")
+    threading.Thread(target=run, name="sofia-warmup", daemon=True).start()
+    return True
+
+start_warmup()
+
+# Iniciar el escritor en segundo plano (reproduce el journal pendiente al arrancar)
+persistence.get_writer()
+
+# Mantenimiento del audio una vez por proceso: borrar temporales huérfanos y precalentar los
+# saludos. Corre en un hilo: crear el cliente importa el SDK de ElevenLabs, que tarda.
+@st.cache_resource
+def start_tts_maintenance():
+    def run():
+        tts.cleanup_leaked_temp_audio()
+        if "elevenlabs" in st.secrets:
+            try:
+                tts.prewarm(clients.get_elevenlabs_client(), frontend.GREETINGS.values(), clean=clean_message_for_audio)
+            except Exception as e:
+                print(f"DEBUG: No se pudo precalentar el caché de audio: {e}")
+    threading.Thread(target=run, name="sofia-tts-maintenance", daemon=True).start()
+    return True
+
+start_tts_maintenance()
+
+@st.cache_resource
+def cleanup_pdf_temp_dirs():
+    # Las versiones anteriores dejaban una carpeta conv_pdf_<sesión> por cada PDF enviado
+    return pdf_export.cleanup_legacy_pdf_dirs()
+
+cleanup_pdf_temp_dirs()
+
+# Índices de Mongo: idempotente; corre en un hilo para no demorar el arranque
+@st.cache_resource
+def start_index_maintenance():
+    def run():
+        try:
+            mongo_settings = dict(st.secrets["mongodb"])
+            mongo_indexes.ensure_indexes(clients.get_mongo_db(), mongo_settings,
+                                         mongo_settings.get("conversation_retention_days"))
+        except Exception as e:
+            print(f"DEBUG: No se pudieron asegurar los índices de MongoDB: {e}")
+    threading.Thread(target=run, name="sofia-mongo-indexes", daemon=True).start()
+    return True
+
+if "mongodb" in st.secrets:
+    start_index_maintenance()
+
+@st.cache_resource
+def start_metrics_server():
+    try:
+        return metrics.start_http_server()
+    except OSError as e:
+        print(f"DEBUG: No se pudo iniciar el servidor de métricas: {e}")
+        return None
+
+if metrics.METRICS_CONFIG["mode"] == "prometheus":
+    start_metrics_server()
+
+def session_knowledge(topic):
+    """Versión de los conocimientos fijada en la sesión (la vigente cuando eligió el tema)."""
+    version = knowledge_base.pinned_version(topic, st.session_state.get("instructions_version"))
+    st.session_state.instructions_version = version.version_id  # Si la fijada ya no se conserva, pasa a la vigente
+    return version
 
-sofia_logo = load_image(SOFIA_AVATAR_PATH)
-user_logo = load_image(USER_LOGO_PATH)
+def topic_instructions(topic):
+    """Instrucciones fijas del tema; se comparten entre sesiones para mantener el prefijo idéntico."""
+    try:
+        version = session_knowledge(topic)
+    except (KeyError, OSError) as e:
+        st.error(f"Error al leer instrucciones para {topic}: {e}")
+        return None
+    return version.prompt_text  # Con recuperación, los conocimientos se agregan por turno
 
 # Inicialización del estado
 if "selected_topic" not in st.session_state:
@@ -42,16 +143,31 @@ if "initial_message_shown" not in st.session_state:
     st.session_state.initial_message_shown = False
 if "subtitle_shown" not in st.session_state:
     st.session_state.subtitle_shown = False
-if "rendered_message_ids" not in st.session_state:
-    st.session_state.rendered_message_ids = set()
+if "rendered_count" not in st.session_state:
+    st.session_state.rendered_count = 0  # Los mensajes anteriores a este índice ya se mostraron una vez
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 0  # Páginas de mensajes anteriores desplegadas
 if "show_form" not in st.session_state:
     st.session_state.show_form = False
+if "turn_timings" not in st.session_state:
+    st.session_state.turn_timings = []  # Tiempos por turno (primer token y total)
+if "first_turn_seen" not in st.session_state:
+    st.session_state.first_turn_seen = False  # Ya llegó la primera pregunta (aunque haya fallado)
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = conversation_history.new_summary_state()
+if "token_usage" not in st.session_state:
+    st.session_state.token_usage = []  # Tokens por llamada (prompt, cacheados y completados)
+
+# Etiquetas de las métricas de este rerun (sin costo si SOFIA_METRICS no está activado)
+rerun_start = time.perf_counter()
+metrics.set_context(st.session_state.session_id, st.session_state.selected_topic)
 
 # Renderizar el encabezado (siempre visible)
 frontend.render_title()
 
 # Sidebar with a button to toggle form
 with st.sidebar:
+    sidebar.render_pdf_job_notice()
     if st.session_state.selected_topic:
         sidebar.toggle_audio_button()  # Llama a la función para el botón
     if st.session_state.selected_topic:
@@ -62,34 +178,6 @@ with st.sidebar:
 if st.session_state.show_form:
     sidebar.save_conversation_form()
 
-def generar_audio_elevenlabs_sdk(texto, voice_id="1BxAZWANeDIxeyHKSJF2"):
-    try:
-        # Inicializa el cliente de ElevenLabs con la clave API
-        client = ElevenLabs(api_key=st.secrets["elevenlabs"]["api_key"])
-
-        # Generar el audio usando el SDK
-        audio_generator = client.text_to_speech.convert(
-            voice_id=voice_id,
-            model_id="eleven_turbo_v2_5",
-            text=texto,
-            voice_settings={
-                "stability": 1,
-                "similarity_boost": 1
-            }
-        )
-
-        # Guardar el audio en un archivo temporal
-        temp_audio = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        with open(temp_audio.name, "wb") as f:
-            for chunk in audio_generator:  # Iterar sobre el generador
-                f.write(chunk)
-
-        return temp_audio.name
-
-    except Exception as e:
-        st.error(f"Error al generar audio: {e}")
-        return None
-
 # Renderizar subtítulo dinámico basado en el tema seleccionado
 if st.session_state.selected_topic:
     if not st.session_state.subtitle_shown:
@@ -104,27 +192,38 @@ if st.session_state.selected_topic is None:
 
 # Mostrar chat y mensajes si se seleccionó un tema
 if st.session_state.selected_topic:
-    # Cargar las instrucciones del sistema solo una vez
+    # Las instrucciones no se copian en la sesión: el texto vive una sola vez en el proceso y se
+    # agrega como mensaje de sistema recién al armar cada solicitud. La sesión queda fijada a la
+    # versión vigente al elegir el tema, aunque después se edite el archivo.
     if not st.session_state.initial_message_shown:
-        instructions = sidebar.load_instructions(st.session_state.selected_topic)
-        if instructions:
-            st.session_state.messages.append({"role": "system", "content": instructions})
-        st.session_state.messages.append({"role": "assistant", "content": st.session_state.initial_message})
+        st.session_state.instructions_version = knowledge_base.instructions_version(st.session_state.selected_topic)
+        st.session_state.messages.append(
+            conversation_history.ChatMessage("assistant", st.session_state.initial_message))
         st.session_state.initial_message_shown = True
 
-    # Renderizar mensajes existentes
-    for i, message in enumerate(st.session_state.messages):
-        if message["role"] != "system":
-            message_id = f"{message['role']}-{i}"
-            if message_id not in st.session_state.rendered_message_ids:
-                if message["role"] == "assistant":
-                    frontend.render_dynamic_message(message, avatar=sofia_logo)
-                else:
-                    frontend.render_chat_message(message["role"], message["content"], avatar=user_logo)
-                st.session_state.rendered_message_ids.add(message_id)
+    # Renderizar mensajes existentes: los más viejos quedan agrupados detrás de "mostrar anteriores",
+    # así el trabajo por rerun no crece con el largo de la conversación
+    with metrics.span("history_render"):
+        messages = st.session_state.messages
+        for i in range(frontend.render_earlier_messages(messages), len(messages)):
+            message = messages[i]
+            if message["role"] == "system":
+                continue
+            if i >= st.session_state.rendered_count and message["role"] == "assistant":
+                frontend.render_dynamic_message(message, avatar=sofia_logo)
+                if (st.session_state.get("audio_enabled") and message["content"] in frontend.GREETINGS.values()
+                        and upstream.available("elevenlabs")):
+                    # Los saludos fijos salen del caché de audio precalentado
+                    try:
+                        audio = tts.synthesize(clients.get_elevenlabs_client(),
+                                               clean_message_for_audio(message["content"]).strip(" ."))
+                        st.audio(audio, format="audio/mp3", autoplay=True)
+                    except Exception as e:
+                        st.error(f"Error al generar audio: {e}")
             else:
                 frontend.render_chat_message(message["role"], message["content"],
                                              avatar=sofia_logo if message["role"] == "assistant" else user_logo)
+        st.session_state.rendered_count = len(messages)
 
     # Renderizar el campo de entrada
     # if prompt := frontend.render_input():
@@ -157,70 +256,151 @@ if st.session_state.selected_topic:
     #         if audio_path:
     #             st.audio(audio_path, format="audio/mp3")
 
-    # Define settings for each topic
-    TOPIC_CONFIG = {
-        "¡Quiero exportar!": {
-            "model": "gpt-4o-mini",
-            "temperature": 0.3,
-            "top_p": 0.1,
-            "frequency_penalty": -0.5,
-            "presence_penalty": -0.5,
-        },
-        "Oportunidades de Inversión": {
-            "model": "gpt-4o-mini",
-            "temperature": 0.3,
-            "top_p": 0.1,
-            "frequency_penalty": 0.2,
-            "presence_penalty": 0.2,
-        },
-        "default": {
-            "model": "gpt-4o-mini",
-            "temperature": 0.3,
-            "top_p": 0.1,
-            "frequency_penalty": 0.2,
-            "presence_penalty": 0.2,
-        }
-    }
-
-    # Select configuration based on topic
+    # Seleccionar la configuración según el tema
     selected_topic = st.session_state.selected_topic
-    if selected_topic in TOPIC_CONFIG:
-        config = TOPIC_CONFIG[selected_topic]
-    else:
-        config = TOPIC_CONFIG["default"]
+    config = chat_requests.get_topic_config(selected_topic)
 
-    # Render input and process response
     # Render input and process response
     if prompt := frontend.render_input():
+        prompt_received = time.perf_counter()
+        # Primera pregunta: anotar cómo quedó el precalentamiento y cancelar los pasos pendientes
+        # (el pedido real ya calienta lo que falte)
+        prefetch_state = None
+        if not st.session_state.first_turn_seen:
+            st.session_state.first_turn_seen = True
+            prefetch_job = st.session_state.get("prefetch")
+            prefetch_state = prefetch.state(prefetch_job)
+            if prefetch_job is not None:
+                prefetch_job.cancel()
+
         # Agregar mensaje del usuario al estado
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        st.session_state.messages.append(conversation_history.ChatMessage("user", prompt))
         frontend.render_chat_message("user", prompt, avatar=user_logo)
 
-        # Llamada a la API de OpenAI para generar respuesta
-        client = OpenAI(api_key=st.secrets["openai"]["api_key"])
-        response = client.chat.completions.create(
-            model=config["model"],
-            messages=st.session_state.messages,
-            temperature=config["temperature"],
-            top_p=config["top_p"],
-            frequency_penalty=config["frequency_penalty"],
-            presence_penalty=config["presence_penalty"],
-        )
-
-        # Extraer contenido de la respuesta y renderizarlo
-        response_content = response.choices[0].message.content
-        response_message = {"role": "assistant", "content": response_content}
+        # Recuperar las secciones de conocimiento relevantes para los últimos turnos
+        context = None
+        if knowledge_base.RETRIEVAL_CONFIG["enabled"]:
+            user_turns = [m["content"] for m in st.session_state.messages if m["role"] == "user"]
+            with metrics.span("retrieval"):
+                context = knowledge_base.build_context(session_knowledge(selected_topic).index,
+                                                       " ".join(user_turns[-2:]))
+
+        # Armar la solicitud con el prefijo fijo del tema primero y el historial acotado
+        instructions = topic_instructions(selected_topic) or ""
+        summary, recent_messages = conversation_history.history_for_request(
+            st.session_state.messages, st.session_state.history_summary)
+        request = chat_requests.build_request(selected_topic, recent_messages, instructions, context, summary)
+
+        # Primera pregunta repetida: se responde desde el caché local (si está activado)
+        client = clients.get_openai_client()
+        turn_start = time.perf_counter()
+        cached_answer = answer_cache.lookup(selected_topic, st.session_state.messages, summary,
+                                            st.session_state.instructions_version)
+        timing = {"topic": selected_topic, "ttft": None, "total": None, "cached": cached_answer is not None,
+                  "prefetch": prefetch_state}
+        stream_usage = []
+        if cached_answer is None:
+            # Llamada a la API de OpenAI en modo streaming (con límite de tasa, reintentos y breaker)
+            try:
+                stream = upstream.stream("openai", client.chat.completions.create, **request)
+            except Exception as e:
+                print(f"DEBUG: Falló la llamada a OpenAI: {e} ({upstream.stats().get('openai')})")
+                with st.chat_message("assistant", avatar=sofia_logo):
+                    st.warning("SofIA no puede responder en este momento por una alta demanda. "
+                               "Por favor, intente de nuevo en unos segundos.")
+                # Sin respuesta, la pregunta no queda en el historial (ni en el auto-guardado)
+                st.session_state.messages.pop()
+                st.stop()
+
+        # Audio en paralelo: cada oración se sintetiza apenas se completa
+        speech = None
+        if st.session_state.audio_enabled and not upstream.available("elevenlabs"):
+            # El TTS está caído: la respuesta sigue solo en texto
+            st.info("El audio no está disponible en este momento; la respuesta se muestra en texto.")
+        elif st.session_state.audio_enabled:
+            try:
+                speech = tts.SpeechPipeline(clients.get_elevenlabs_client(), clean=clean_message_for_audio)
+            except Exception as e:
+                st.error(f"Error al generar audio: {e}")
+        with st.chat_message("assistant", avatar=sofia_logo):
+            text_slot = st.empty()
+            audio_slot = st.container()
+        audio_turn = len(st.session_state.messages)
+        audio_chunks = []
+
+        def play_ready_audio(chunks):
+            with audio_slot:
+                for audio in chunks:
+                    tts.render_audio_chunk(audio, audio_turn)
+                    audio_chunks.append(audio)
+
+        def model_deltas():
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    stream_usage.append(chunk.usage)  # El último fragmento trae el uso de tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
+        def stream_deltas():
+            # Entrega los fragmentos de texto a medida que llegan y mide el primer token
+            for delta in (model_deltas() if cached_answer is None else [cached_answer]):
+                if timing["ttft"] is None:
+                    timing["ttft"] = time.perf_counter() - turn_start
+                if speech:
+                    speech.feed(delta)
+                    play_ready_audio(speech.ready())
+                yield delta
+
+        # Renderizar la respuesta a medida que se genera
+        try:
+            response_content = frontend.stream_markdown(text_slot, stream_deltas())
+        except Exception as e:
+            # El stream se cortó a mitad de la respuesta: no se guarda una respuesta incompleta
+            print(f"DEBUG: Se cortó la respuesta de OpenAI: {e} ({upstream.stats().get('openai')})")
+            text_slot.warning("La respuesta de SofIA se interrumpió. Por favor, intente de nuevo.")
+            st.session_state.messages.pop()
+            st.stop()
+        timing["total"] = time.perf_counter() - turn_start
+        st.session_state.turn_timings.append(timing)
+        if timing["ttft"] is not None:
+            metrics.observe("answer_cache_ttft" if timing["cached"] else "openai_ttft", timing["ttft"])
+            if prefetch_state is not None and not timing["cached"]:
+                # Desde que llegó la pregunta: incluye instrucciones, clientes y conexiones en frío
+                timing["first_turn_ttft"] = turn_start - prompt_received + timing["ttft"]
+                metrics.observe(f"first_turn_ttft_{prefetch.FIRST_TURN_LABELS[prefetch_state]}",
+                                timing["first_turn_ttft"])
+        metrics.observe("answer_total", timing["total"])
+        usage_record = chat_requests.record_usage(selected_topic, config["model"],
+                                                  stream_usage[-1] if stream_usage else None,
+                                                  chat_requests.prefix_hash(instructions))
+        if usage_record:
+            st.session_state.token_usage.append(usage_record)
+        if cached_answer is None:
+            answer_cache.store(selected_topic, st.session_state.messages, response_content, summary,
+                               st.session_state.instructions_version)
+
+        response_message = conversation_history.ChatMessage("assistant", response_content)
         st.session_state.messages.append(response_message)
+        st.session_state.rendered_count = len(st.session_state.messages)
 
-        frontend.render_dynamic_message(response_message, avatar=sofia_logo)
-        st.session_state.rendered_message_ids.add(f"assistant-{len(st.session_state.messages) - 1}")
-
-        # Generar y reproducir audio si está habilitado
-        if st.session_state.audio_enabled:
-            texto_limpio = clean_message_for_audio(response_content)
-            audio_path = generar_audio_elevenlabs_sdk(texto_limpio)
-            if audio_path:
-                st.audio(audio_path, format="audio/mp3")
+        # Completar el audio con las oraciones que faltan y dejar la respuesta completa para repetirla
+        if speech:
+            with metrics.span("tts_tail"):
+                speech.close()
+                play_ready_audio(speech.remaining())
+                if audio_chunks:
+                    with audio_slot:
+                        st.audio(b"".join(audio_chunks), format="audio/mp3")
 
         # Guardar automáticamente la conversación en Google Cloud Storage
         sidebar.auto_save_conversation()
+
+        # Resumir los turnos más viejos si el historial superó el presupuesto de tokens
+        with metrics.span("fold_history"):
+            st.session_state.history_summary = conversation_history.fold_history(
+                client, st.session_state.messages, st.session_state.history_summary)
+
+metrics.observe("rerun", time.perf_counter() - rerun_start)
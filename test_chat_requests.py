@@ -0,0 +1,37 @@
+# test_chat_requests.py
+from types import SimpleNamespace
+import pytest
+import chat_requests
+import metrics
+
+EXPORT_TOPIC = "¡Quiero exportar!"
+INVEST_TOPIC = "Oportunidades de Inversión"
+
+
+def usage(prompt_tokens, cached_tokens, completion_tokens):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                           prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+def record_two_topics():
+    chat_requests._usage_by_topic.clear()
+    chat_requests.record_usage(EXPORT_TOPIC, "gpt-4o-mini", usage(1200, 1024, 100))
+    chat_requests.record_usage(EXPORT_TOPIC, "gpt-4o-mini", usage(1300, 1024, 50))
+    chat_requests.record_usage(INVEST_TOPIC, "gpt-4o-mini", usage(1000, 0, 200))
+
+
+def test_usage_rollups_per_topic():
+    record_two_topics()
+    rollups = chat_requests.usage_rollups()
+    assert set(rollups) == {EXPORT_TOPIC, INVEST_TOPIC}
+    export = rollups[EXPORT_TOPIC]
+    assert (export["calls"], export["prompt_tokens"], export["cached_tokens"], export["completion_tokens"]) == (2, 2500, 2048, 150)
+    assert export["cache_hit_rate"] == 2048 / 2500
+    assert export["cost_usd"] == pytest.approx(chat_requests.usage_cost("gpt-4o-mini", 2500, 2048, 150))
+    assert rollups[INVEST_TOPIC]["cache_hit_rate"] == 0.0
+
+def test_usage_rollups_are_exported_as_gauges():
+    record_two_topics()
+    gauges = {(name, labels.get("topic")): value for name, labels, value in metrics.default_gauges()}
+    assert gauges[("sofia_openai_calls_total", EXPORT_TOPIC)] == 2
+    assert gauges[("sofia_openai_completion_tokens_total", INVEST_TOPIC)] == 200
+    assert gauges[("sofia_openai_cache_hit_rate", EXPORT_TOPIC)] == 2048 / 2500
@@ -0,0 +1,107 @@
+# test_download_pdfs.py
+import io
+import os
+import tarfile
+import zipfile
+import mongomock
+import pytest
+from bson import ObjectId
+import download_pdfs
+
+EXPORT_TOPIC = "¡Quiero exportar!"
+INVEST_TOPIC = "Oportunidades de Inversión"
+
+
+class FakeBucket:
+    """GridFSBucket mínimo sobre bytes en memoria (la integración de GridFS de mongomock no
+    funciona con pymongo 4.9+); cuenta las descargas para verificar los salteados."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.opened = []
+
+    def open_download_stream(self, file_id):
+        self.opened.append(file_id)
+        return io.BytesIO(self.contents[file_id])
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    for day, topic, email in ((1, EXPORT_TOPIC, "ana@ejemplo.com"), (2, EXPORT_TOPIC, "juan@ejemplo.com"),
+                              (3, INVEST_TOPIC, "ana@ejemplo.com"), (9, EXPORT_TOPIC, "ana@ejemplo.com")):
+        file_id = ObjectId()
+        db["pdfs.files"].insert_one({"_id": file_id, "filename": f"2025040{day}_{email.split('@')[0].upper()}.pdf", "length": 10})
+        db.pdf_metadata.insert_one({"pdf_gridfs_id": file_id, "topic": topic, "email": email,
+                                    "timestamp": f"2025-04-0{day}T10:00:00-03:00"})
+    db.pdf_metadata.insert_one({"pdf_gridfs_id": None, "topic": EXPORT_TOPIC,
+                                "timestamp": "2025-04-01T11:00:00-03:00"})
+    return db
+
+
+def test_metadata_query_filters():
+    query = download_pdfs.metadata_query("2025-04-01", "2025-04-07", EXPORT_TOPIC, " Ana@Ejemplo.com ", "s1")
+    assert query == {
+        "pdf_gridfs_id": {"$ne": None},
+        "timestamp": {"$gte": "2025-04-01", "$lt": "2025-04-08"},
+        "topic": EXPORT_TOPIC,
+        "email": "Ana@Ejemplo.com",
+        "session_id": "s1",
+    }
+    assert download_pdfs.metadata_query() == {"pdf_gridfs_id": {"$ne": None}}
+
+def test_select_files_in_batches(db, monkeypatch):
+    monkeypatch.setitem(download_pdfs.EXPORT_CONFIG, "id_batch_size", 1)
+    query = download_pdfs.metadata_query("2025-04-01", "2025-04-07", EXPORT_TOPIC)
+    files = download_pdfs.select_files(db, "pdf_metadata", "pdfs", query)
+    assert sorted(doc["filename"] for doc in files) == ["20250401_ANA.pdf", "20250402_JUAN.pdf"]
+
+def test_select_files_by_filename(db):
+    files = download_pdfs.select_files(db, "pdf_metadata", "pdfs", filename="20250403_ANA.pdf")
+    assert [doc["length"] for doc in files] == [10]
+
+def test_export_resumes_and_skips_complete_files(db, tmp_path):
+    files = download_pdfs.select_files(db, "pdf_metadata", "pdfs")
+    bucket = FakeBucket({doc["_id"]: bytes([i]) * 10 for i, doc in enumerate(files)})
+    names = download_pdfs.local_names(files)
+    # Una corrida anterior dejó un archivo completo y un .part a medias
+    complete, partial = files[0], files[1]
+    (tmp_path / names[complete["_id"]]).write_bytes(bucket.contents[complete["_id"]])
+    (tmp_path / (names[partial["_id"]] + ".part")).write_bytes(b"xx")
+
+    stats, paths = download_pdfs.export_files(bucket, files, str(tmp_path), workers=2)
+    assert (stats["downloaded"], stats["skipped"], stats["failed"]) == (3, 1, 0)
+    assert complete["_id"] not in bucket.opened
+    assert (tmp_path / names[partial["_id"]]).read_bytes() == bucket.contents[partial["_id"]]
+    assert not list(tmp_path.glob("*.part"))
+    assert len(paths) == 4
+
+def test_download_rejects_truncated_file(tmp_path):
+    file_id = ObjectId()
+    bucket = FakeBucket({file_id: b"123"})
+    path = str(tmp_path / "a.pdf")
+    with pytest.raises(IOError):
+        download_pdfs.download_file(bucket, {"_id": file_id, "filename": "a.pdf", "length": 10}, path)
+    assert not os.path.exists(path)
+
+@pytest.mark.parametrize("extension", [".zip", ".tar", ".tar.gz"])
+def test_write_archive(tmp_path, extension):
+    paths = []
+    for name in ("a.pdf", "b.pdf"):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    archive_path = str(tmp_path / f"export{extension}")
+    download_pdfs.write_archive(paths, archive_path)
+    if extension == ".zip":
+        with zipfile.ZipFile(archive_path) as archive:
+            assert archive.namelist() == ["a.pdf", "b.pdf"]
+            assert archive.read("b.pdf") == b"b.pdf"
+    else:
+        with tarfile.open(archive_path) as archive:
+            assert archive.getnames() == ["a.pdf", "b.pdf"]
+            assert archive.extractfile("b.pdf").read() == b"b.pdf"
+
+def test_write_archive_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        download_pdfs.write_archive([], str(tmp_path / "export.rar"))
@@ -0,0 +1,45 @@
+# test_knowledge_base.py
+import knowledge_base
+
+EXPORT_TOPIC = "¡Quiero exportar!"
+INVEST_TOPIC = "Oportunidades de Inversión"
+
+
+def split(topic):
+    return knowledge_base.split_instructions(knowledge_base.read_instructions(topic))
+
+def section_texts(sections):
+    return "\n".join(section["text"] for section in sections)
+
+
+def test_rules_block_stays_fixed():
+    fixed_text, sections = split(EXPORT_TOPIC)
+    tail = knowledge_base.read_instructions(EXPORT_TOPIC).rsplit("## Reglas inquebrantables", 1)[1]
+    assert tail.strip() in fixed_text
+    assert "Bases de respuesta" in fixed_text
+    assert "NO debe superar los 3 parrafos" in fixed_text
+    assert "## Reglas inquebrantables" not in section_texts(sections)
+    assert "NO debe superar los 3 parrafos" not in section_texts(sections)
+
+def test_faq_guidance_stays_fixed():
+    fixed_text, sections = split(INVEST_TOPIC)
+    assert "## Sección de Preguntas frecuentes del usuario y cómo abordarlas" in fixed_text
+    assert "Respuesta base predeterminada obligatoria" in fixed_text
+    assert "Preguntas frecuentes" not in section_texts(sections)
+
+def test_index_stays_fixed_and_knowledge_is_retrievable():
+    fixed_text, sections = split(EXPORT_TOPIC)
+    assert "## INDICE" in fixed_text
+    assert any("INCOTERMS" in section["path"] for section in sections)
+
+def test_fixed_heading_keeps_its_subsections():
+    text = ("# Persona\n\n# CONOCIMIENTOS\n\n## Reglas generales\n- Regla uno\n### Detalle de reglas\n- Regla dos\n"
+            "## Tema A\nContenido A\n### Subtema\nContenido B\n")
+    fixed_text, sections = knowledge_base.split_instructions(text)
+    assert "Regla dos" in fixed_text
+    assert [section["path"] for section in sections] == [["Tema A"], ["Tema A", "Subtema"]]
+
+def test_greeting_keeps_rules_with_retrieval():
+    index = knowledge_base.build_index(EXPORT_TOPIC)
+    assert knowledge_base.retrieve(index, "hola") == []
+    assert "Reglas inquebrantables" in index["fixed_text"]
@@ -0,0 +1,19 @@
+# test_text_normalizer.py
+import os
+import json
+import pytest
+from text_normalizer import normalize_for_audio, normalize_for_pdf
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "text_normalizer_golden.json")
+
+with open(GOLDEN_PATH, "r", encoding="utf-8") as file:
+    GOLDEN_CASES = json.load(file)
+
+
+@pytest.mark.parametrize("case", GOLDEN_CASES, ids=[case["name"] for case in GOLDEN_CASES])
+def test_golden_audio(case):
+    assert normalize_for_audio(case["input"]) == case["audio"]
+
+@pytest.mark.parametrize("case", GOLDEN_CASES, ids=[case["name"] for case in GOLDEN_CASES])
+def test_golden_pdf(case):
+    assert normalize_for_pdf(case["input"]) == case["pdf"]
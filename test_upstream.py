@@ -0,0 +1,83 @@
+# test_upstream.py
+import time
+import pytest
+import upstream
+
+
+class FakeError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def make_provider(**overrides):
+    config = dict(upstream.UPSTREAM_CONFIG["openai"], max_retries=0, failure_threshold=2,
+                  reset_timeout=0.05, **overrides)
+    return upstream.Provider("test", config)
+
+def fail(status_code):
+    def fn():
+        raise FakeError(status_code)
+    return fn
+
+def open_breaker(provider):
+    for _ in range(provider.config["failure_threshold"]):
+        with pytest.raises(FakeError):
+            provider.call(fail(503))
+    assert provider.breaker.state == "open"
+
+
+def test_breaker_opens_and_rejects():
+    provider = make_provider()
+    open_breaker(provider)
+    with pytest.raises(upstream.ProviderUnavailable):
+        provider.call(lambda: "ok")
+
+def test_client_error_on_probe_releases_it():
+    provider = make_provider()
+    open_breaker(provider)
+    time.sleep(provider.config["reset_timeout"])
+    assert provider.breaker.state == "half_open"
+    with pytest.raises(FakeError):
+        provider.call(fail(400))
+    # El 400 no dice nada del servicio: la próxima llamada puede hacer la prueba
+    assert provider.call(lambda: "ok") == "ok"
+    assert provider.breaker.state == "closed"
+
+def test_server_error_on_probe_reopens():
+    provider = make_provider()
+    open_breaker(provider)
+    time.sleep(provider.config["reset_timeout"])
+    with pytest.raises(FakeError):
+        provider.call(fail(503))
+    assert provider.breaker.state == "open"
+
+def broken_stream(status_code):
+    def fn():
+        yield "Hola"
+        raise FakeError(status_code)
+    return fn
+
+def test_streams_cut_midway_open_the_breaker():
+    provider = make_provider()
+    for _ in range(provider.config["failure_threshold"]):
+        with pytest.raises(FakeError):
+            list(provider.stream(broken_stream(502)))
+    assert provider.breaker.state == "open"
+    assert provider.stats()["in_flight"] == 0
+
+def test_client_error_midway_on_probe_releases_it():
+    provider = make_provider()
+    open_breaker(provider)
+    time.sleep(provider.config["reset_timeout"])
+    with pytest.raises(FakeError):
+        list(provider.stream(broken_stream(400)))
+    assert list(provider.stream(lambda: iter(["ok"]))) == ["ok"]
+    assert provider.breaker.state == "closed"
+
+def test_abandoned_probe_stream_releases_the_probe():
+    provider = make_provider()
+    open_breaker(provider)
+    time.sleep(provider.config["reset_timeout"])
+    provider.stream(lambda: iter(["a", "b"])).close()
+    assert provider.call(lambda: "ok") == "ok"
@@ -0,0 +1,363 @@
+# text_normalizer.py
+"""
+Normalización de texto en una sola pasada para el audio (TTS) y el PDF.
+
+Cada perfil compila una única expresión regular que alterna todas las reglas (léxico,
+montos, teléfonos, horarios, fechas, medidas, números, markdown y emojis); el texto se recorre una vez y
+cada coincidencia se resuelve con su función. El léxico se carga de tts_lexicon.json.
+"""
+import os
+import re
+import json
+import threading
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_lexicon.json")
+
+# --- Números en palabras (español) ---
+
+UNITS = ["cero", "uno", "dos", "tres", "cuatro", "cinco", "seis", "siete", "ocho", "nueve",
+         "diez", "once", "doce", "trece", "catorce", "quince", "dieciséis", "diecisiete",
+         "dieciocho", "diecinueve", "veinte", "veintiuno", "veintidós", "veintitrés",
+         "veinticuatro", "veinticinco", "veintiséis", "veintisiete", "veintiocho", "veintinueve"]
+TENS = ["", "", "", "treinta", "cuarenta", "cincuenta", "sesenta", "setenta", "ochenta", "noventa"]
+MONTHS = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre",
+          "octubre", "noviembre", "diciembre"]
+HUNDREDS = ["", "ciento", "doscientos", "trescientos", "cuatrocientos", "quinientos",
+            "seiscientos", "setecientos", "ochocientos", "novecientos"]
+
+
+def _below_hundred(n, apocope, feminine=False):
+    if n < 30:
+        word = UNITS[n]
+        if feminine and n in (1, 21):
+            word = "una" if n == 1 else "veintiuna"
+        elif apocope and n in (1, 21):
+            word = "un" if n == 1 else "veintiún"
+        return word
+    tens, unit = divmod(n, 10)
+    if not unit:
+        return TENS[tens]
+    if unit == 1 and (feminine or apocope):
+        return f"{TENS[tens]} y {'una' if feminine else 'un'}"
+    return f"{TENS[tens]} y {UNITS[unit]}"
+
+def _below_thousand(n, apocope, feminine=False):
+    if n == 100:
+        return "cien"
+    hundreds, rest = divmod(n, 100)
+    parts = []
+    if hundreds:
+        # "doscientas empresas"; "ciento" no cambia
+        parts.append(HUNDREDS[hundreds].replace("ientos", "ientas") if feminine else HUNDREDS[hundreds])
+    if rest:
+        parts.append(_below_hundred(rest, apocope, feminine))
+    return " ".join(parts)
+
+def _below_million(n, apocope, feminine=False):
+    thousands, rest = divmod(n, 1000)
+    parts = []
+    if thousands == 1:
+        parts.append("mil")
+    elif thousands:
+        parts.append(f"{_below_thousand(thousands, True, feminine)} mil")
+    if rest:
+        parts.append(_below_thousand(rest, apocope, feminine))
+    return " ".join(parts)
+
+def number_to_words(n, apocope=False, feminine=False):
+    """
+    Convierte un entero no negativo a palabras (escala larga: mil millones, billones).
+    `apocope` da la forma ante sustantivo masculino ("un", "veintiún") y `feminine` la
+    femenina ("una", "doscientas").
+    """
+    if n == 0:
+        return "cero"
+    parts = []
+    for value, singular, plural in ((10 ** 12, "un billón", "billones"), (10 ** 6, "un millón", "millones")):
+        count, n = divmod(n, value)
+        if count == 1:
+            parts.append(singular)
+        elif count:
+            parts.append(f"{_below_million(count, True)} {plural}")
+    if n:
+        parts.append(_below_million(n, apocope, feminine))
+    return " ".join(parts)
+
+def parse_amount(text):
+    """
+    '2.000.000' -> (2000000, None); '1.500,50' -> (1500, '50'); '3.5' -> (3, '5');
+    '12,345.67' (formato de EE.UU.) -> (12345, '67').
+    """
+    if DECIMAL_POINT.fullmatch(text) or US_AMOUNT.fullmatch(text):
+        integer, _, decimals = text.partition(".")
+        return int(integer.replace(",", "")), decimals
+    integer, _, decimals = text.partition(",")
+    return int(integer.replace(".", "")), (decimals or None)
+
+def decimals_to_words(decimals):
+    """Parte decimal: '5' -> 'cinco', '05' -> 'cero cinco'."""
+    significant = decimals.lstrip("0")
+    words = ["cero"] * (len(decimals) - len(significant))
+    if significant:
+        words.append(number_to_words(int(significant)))
+    return " ".join(words)
+
+
+# --- Reglas del verbalizador ---
+
+# Un número termina donde no sigue otra cifra, letra ni ".5", ",5" o "/5" (y no empieza después
+# de "/"): así "3.1.2", "1/5" o "12.345.67" no se leen a medias ("tres.1.2"); si ninguna regla toma
+# el token completo, queda igual
+NUMBER_END = r"(?!\w|[.,/]\d)"
+US_AMOUNT = re.compile(r"\d{1,3}(?:,\d{3})+\.\d{1,2}")
+CURRENCY_PATTERN = (r"(?:US\$|U\$S|USD|\$)\s?(?:\d{1,3}(?:,\d{3})+\.\d{1,2}|\d+\.\d{1,2}"
+                    r"|\d{1,3}(?:\.\d{3})*(?:,\d{1,2})?|\d+(?:,\d{1,2})?)" + NUMBER_END)
+PERCENT_PATTERN = r"\d+(?:[.,]\d+)?\s?%"
+TIME_PATTERN = r"(?<!\d)(?:[01]?\d|2[0-3]):[0-5]\d(?!\d)"
+PHONE_PATTERN = r"(?<!\d)\d{10}(?!\d)"
+# Fechas con año: 15/05/2024, 1.5.2024, 15-05-24
+DATE_PATTERN = (r"(?<![\w.,/-])(?:"
+                + "|".join(rf"(?:0?[1-9]|[12]\d|3[01]){sep}(?:0?[1-9]|1[0-2]){sep}(?:\d{{4}}|\d{{2}})"
+                           for sep in ("/", r"\.", "-"))
+                + r")(?!\w|[./-]\d)")
+EMAIL_PATTERN = r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+URL_PATTERN = r"https?://\S*[^\s.,;:)]"   # Sin la puntuación que cierra la oración: "(ver https://x.gob.ar)."
+# Punto decimal con uno o dos decimales ("3.5"); con tres dígitos es separador de miles ("3.500")
+DECIMAL_POINT_PATTERN = r"(?<![\w.,/])\d+\.\d{1,2}" + NUMBER_END
+DECIMAL_POINT = re.compile(r"\d+\.\d{1,2}")
+GROUPED_NUMBER_PATTERN = r"(?<![\w./])\d{1,3}(?:\.\d{3})+(?:,\d+)?" + NUMBER_END
+NUMBER_PATTERN = r"(?<![\w.,/])\d{1,12}(?:,\d+)?" + NUMBER_END
+
+# Unidades después de un número ("5km", "3,5 kg"): singular, plural y si el número va en femenino.
+# Solo abreviaturas que no se confunden con palabras ("ha" o "l" sueltas sí se confundirían)
+MEASURE_UNITS = {
+    "km2": ("kilómetro cuadrado", "kilómetros cuadrados", False),
+    "km²": ("kilómetro cuadrado", "kilómetros cuadrados", False),
+    "m2": ("metro cuadrado", "metros cuadrados", False),
+    "m²": ("metro cuadrado", "metros cuadrados", False),
+    "km": ("kilómetro", "kilómetros", False),
+    "cm": ("centímetro", "centímetros", False),
+    "mm": ("milímetro", "milímetros", False),
+    "m": ("metro", "metros", False),
+    "kg": ("kilogramo", "kilogramos", False),
+    "gr": ("gramo", "gramos", False),
+    "g": ("gramo", "gramos", False),
+    "tn": ("tonelada", "toneladas", True),
+    "lts": ("litro", "litros", False),
+    "lt": ("litro", "litros", False),
+    "ml": ("mililitro", "mililitros", False),
+}
+MEASURE_PATTERN = (r"(?<![\w.,])(?:\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:[.,]\d{1,2})?)\s?(?:"
+                   + "|".join(sorted(MEASURE_UNITS, key=len, reverse=True)) + r")(?!\w)")
+
+# Concordancia del número con la palabra que sigue: "1 empresa" -> "una empresa",
+# "21 productos" -> "veintiún productos", "1 de mayo" -> "uno de mayo". Solo palabras en
+# minúscula: "en 2021 Argentina" no es un sustantivo contado
+NOT_NOUNS = ("a ante bajo con contra de del desde durante e en entre es está están era fue fueron ha han "
+             "hasta hay hacia la las lo los el al más menos ni o para por que según ser será sin sobre son "
+             "tras u y ya").split()
+MASCULINE_IN_A = ("clima climas día días dilema dilemas esquema esquemas idioma idiomas mapa mapas planeta "
+                  "planetas problema problemas programa programas sistema sistemas tema temas").split()
+FEMININE_WORDS = ("base bases clase clases fase fases fuente fuentes gente imagen imágenes ley leyes mano "
+                  "manos mujer mujeres noche noches parte partes red redes tarde tardes vez veces").split()
+FEMININE_ENDINGS = r"(?:as?|ción|ciones|sión|siones|dad|dades|tad|tades|tud|tudes|umbre|umbres)"
+NOUN_AFTER_NUMBER = rf"(?=\s+(?!(?:{'|'.join(NOT_NOUNS)})\b)[a-záéíóúüñ]+\b)"
+FEMININE_AFTER_NUMBER = (rf"(?=\s+(?!(?:{'|'.join(NOT_NOUNS + MASCULINE_IN_A)})\b)"
+                         rf"(?:(?:{'|'.join(FEMININE_WORDS)})|[a-záéíóúüñ]*{FEMININE_ENDINGS})\b)")
+
+
+def verbalize_currency(text):
+    dollars = not text.startswith("$")
+    amount_text = re.sub(r"^(?:US\$|U\$S|USD|\$)\s?", "", text)
+    amount, cents = parse_amount(amount_text)
+    unit_singular, unit_plural = ("dólar", "dólares") if dollars else ("peso", "pesos")
+    words = number_to_words(amount, apocope=True)
+    if amount == 1:
+        spoken = f"{words} {unit_singular}"
+    elif amount >= 10 ** 6 and amount % 10 ** 6 == 0:
+        spoken = f"{words} de {unit_plural}"  # "dos mil millones de pesos"
+    else:
+        spoken = f"{words} {unit_plural}"
+    if cents and int(cents):
+        spoken += f" con {number_to_words(int(cents.ljust(2, '0')))} centavos"
+    return spoken
+
+def verbalize_date(text):
+    """'15/05/2024' -> 'quince de mayo de dos mil veinticuatro' (años de dos cifras: 20xx)."""
+    day, month, year = re.split(r"[/.-]", text)
+    year = int(year) + 2000 if len(year) == 2 else int(year)
+    return f"{number_to_words(int(day))} de {MONTHS[int(month) - 1]} de {number_to_words(year)}"
+
+def verbalize_measure(text):
+    """'5km' -> 'cinco kilómetros'; '1 tn' -> 'una tonelada'; '3.5 kg' -> 'tres coma cinco kilogramos'."""
+    number, unit = re.fullmatch(r"([\d.,]+)\s?(\S+)", text).groups()
+    singular, plural, feminine = MEASURE_UNITS[unit]
+    amount, decimals = parse_amount(number)
+    spoken = verbalize_number(number, None if decimals else ("f" if feminine else "m"))
+    return f"{spoken} {singular if amount == 1 and not decimals else plural}"
+
+def verbalize_percent(text):
+    return f"{verbalize_number(text.rstrip('% ').strip())} por ciento"
+
+def verbalize_time(text):
+    hours, minutes = (int(part) for part in text.split(":"))
+    spoken = number_to_words(hours)
+    if minutes:
+        spoken += f" y {number_to_words(minutes)}"
+    return spoken
+
+def verbalize_phone(text):
+    """Característica dígito por dígito y el resto de a pares: '2954575326' ->
+    'dos nueve cinco cuatro, cincuenta y siete, cincuenta y tres, veintiséis'."""
+    area = " ".join(UNITS[int(digit)] for digit in text[:4])
+    pairs = [number_to_words(int(text[i:i + 2])) if text[i] != "0" else f"cero {UNITS[int(text[i + 1])]}"
+             for i in range(4, 10, 2)]
+    return ", ".join([area] + pairs)
+
+def verbalize_email(text):
+    user, _, domain = text.partition("@")
+    return f"{user}, arroba, {', punto, '.join(domain.split('.'))}"
+
+def verbalize_number(text, gender=None):
+    """`gender`: "m" o "f" si el número precede a un sustantivo (sin decimales)."""
+    amount, decimals = parse_amount(text)
+    if decimals:
+        return f"{number_to_words(amount)} coma {decimals_to_words(decimals)}"
+    return number_to_words(amount, apocope=gender == "m", feminine=gender == "f")
+
+
+# --- Motor de una sola pasada ---
+
+def char_class(chars):
+    """Clase [...] con los caracteres agrupados en rangos (las listas largas de literales
+    fuera del plano básico se evalúan una por una y hacen lento al motor)."""
+    codes = sorted(set(ord(char) for char in chars))
+    ranges = []
+    for code in codes:
+        if ranges and code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    parts = []
+    for start, end in ranges:
+        parts.append(re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}")
+    return "[" + "".join(parts) + "]"
+
+def trie_pattern(words):
+    """
+    Expresión regular equivalente a la alternancia de `words`, armada como un trie:
+    los prefijos comunes se factorizan y las ramas de un solo carácter se agrupan en
+    clases [...]. Una búsqueda anticipada con la clase de primeros caracteres permite
+    descartar cada posición con una sola consulta. Ante prefijos, prefiere la
+    coincidencia más larga.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        is_end = "" in node
+        singles, branches = [], []
+        for char in sorted(key for key in node if key):
+            child = node[char]
+            if list(child) == [""]:
+                singles.append(char)
+            else:
+                branches.append(re.escape(char) + build(child))
+        if len(singles) == 1:
+            branches.append(re.escape(singles[0]))
+        elif singles:
+            branches.append(char_class(singles))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 and not is_end else "(?:" + "|".join(branches) + ")"
+        return body + "?" if is_end else body
+
+    return f"(?={char_class(key for key in trie if key)}){build(trie)}"
+
+def _emoji_pattern():
+    import emoji
+    return "(?:" + trie_pattern(emoji.EMOJI_DATA) + ")\ufe0f?"
+
+def _lexicon_pattern(lexicon):
+    return r"(?<!\w)(?:" + trie_pattern(lexicon) + r")(?!\w)"
+
+class Normalizer:
+    """Aplica una lista de reglas (nombre, patrón, reemplazo) en una única pasada."""
+
+    def __init__(self, rules):
+        self._handlers = {}
+        alternatives = []
+        for name, pattern, replacement in rules:
+            alternatives.append(f"(?P<{name}>{pattern})")
+            self._handlers[name] = replacement if callable(replacement) else (lambda _, r=replacement: r)
+        self._pattern = re.compile("|".join(alternatives))
+
+    def _replace(self, match):
+        return self._handlers[match.lastgroup](match.group())
+
+    def __call__(self, text):
+        return self._pattern.sub(self._replace, text)
+
+
+def load_lexicon(path=LEXICON_PATH):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def build_audio_normalizer(lexicon):
+    return Normalizer([
+        ("url", URL_PATTERN, ""),
+        ("email", EMAIL_PATTERN, verbalize_email),
+        ("currency", CURRENCY_PATTERN, verbalize_currency),
+        ("percent", PERCENT_PATTERN, verbalize_percent),
+        ("time", TIME_PATTERN, verbalize_time),
+        ("phone", PHONE_PATTERN, verbalize_phone),
+        ("date", DATE_PATTERN, verbalize_date),
+        ("measure", MEASURE_PATTERN, verbalize_measure),
+        ("counted_feminine", f"(?:{GROUPED_NUMBER_PATTERN}|{NUMBER_PATTERN}){FEMININE_AFTER_NUMBER}",
+         lambda text: verbalize_number(text, "f")),
+        ("counted", f"(?:{GROUPED_NUMBER_PATTERN}|{NUMBER_PATTERN}){NOUN_AFTER_NUMBER}",
+         lambda text: verbalize_number(text, "m")),
+        ("decimal", DECIMAL_POINT_PATTERN, verbalize_number),
+        ("grouped", GROUPED_NUMBER_PATTERN, verbalize_number),
+        ("number", NUMBER_PATTERN, verbalize_number),
+        ("lexicon", _lexicon_pattern(lexicon), lambda text: lexicon[text]),
+        ("bold", r"\*\*", ""),
+        ("emoji", _emoji_pattern(), ""),
+        ("hash", r"#", ""),
+        ("colon", r":", ""),            # Los dos puntos generan pausas raras en el TTS
+        ("newline", r"\n", ". "),
+    ])
+
+def build_pdf_normalizer():
+    return Normalizer([
+        ("bold", r"\*\*", ""),
+        ("emoji", _emoji_pattern(), ""),
+        ("hash", r"#", ""),
+        ("newline", r"\n", "<br>"),
+    ])
+
+
+_normalizers = {}
+_normalizers_lock = threading.Lock()
+
+def get_normalizer(profile):
+    """Normalizador compilado por perfil ("audio" o "pdf"), una vez por proceso."""
+    with _normalizers_lock:
+        if profile not in _normalizers:
+            if profile == "audio":
+                _normalizers[profile] = build_audio_normalizer(load_lexicon()["audio"])
+            elif profile == "pdf":
+                _normalizers[profile] = build_pdf_normalizer()
+            else:
+                raise ValueError(f"Perfil de normalización desconocido: {profile}")
+        return _normalizers[profile]
+
+def normalize_for_audio(text):
+    return get_normalizer("audio")(text)
+
+def normalize_for_pdf(text):
+    return get_normalizer("pdf")(text)
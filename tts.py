@@ -0,0 +1,317 @@
+# tts.py
+"""
+Texto a voz con ElevenLabs en paralelo a la generación del texto.
+
+La respuesta se corta en oraciones a medida que llega; cada fragmento se sintetiza en un
+pool chico de hilos y se reproduce en orden apenas está listo, así el primer audio suena
+después de la primera oración y no al final de toda la respuesta.
+"""
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import upstream
+import metrics
+
+TTS_CONFIG = {
+    "voice_id": "1BxAZWANeDIxeyHKSJF2",
+    "model_id": "eleven_turbo_v2_5",
+    "voice_settings": {"stability": 1, "similarity_boost": 1},
+    "workers": 3,
+    "min_first_chunk_chars": 40,   # El primer fragmento es corto para que el audio arranque rápido
+    "min_chunk_chars": 160,        # Los siguientes agrupan oraciones para hacer menos llamadas
+    "cache_dir": os.environ.get("SOFIA_TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sofia_tts_cache")),
+    "cache_max_bytes": 200 * 1024 * 1024,
+    "cache_max_entries": 5000,
+    "leaked_temp_max_age": 3600,   # Segundos antes de borrar MP3 temporales huérfanos
+}
+
+# Fin de oración: puntuación seguida de espacio, o salto de línea
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool de hilos compartido por el proceso para la síntesis de voz."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=TTS_CONFIG["workers"], thread_name_prefix="sofia-tts")
+        return _executor
+
+def cache_key(text, voice_id=None):
+    """Hash del texto limpio y de todos los parámetros que cambian el audio generado."""
+    payload = json.dumps({
+        "text": text,
+        "voice_id": voice_id or TTS_CONFIG["voice_id"],
+        "model_id": TTS_CONFIG["model_id"],
+        "voice_settings": TTS_CONFIG["voice_settings"],
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Caché en disco de audios MP3 direccionado por contenido, con desalojo LRU por tamaño
+    total y cantidad de entradas. El mtime de cada archivo marca su último uso.
+    """
+
+    def __init__(self, directory, max_bytes, max_entries):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # clave -> (último uso, tamaño)
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".mp3"):
+                stat = os.stat(os.path.join(directory, name))
+                self._entries[name[:-4]] = (stat.st_mtime, stat.st_size)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            self._entries[key] = (now, entry[1])
+        try:
+            with open(self._path(key), "rb") as audio_file:
+                audio = audio_file.read()
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        # Escritura atómica: archivo temporal en el mismo directorio y os.replace
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(audio)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._entries[key] = (time.time(), len(audio))
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for _, size in self._entries.values())
+        if total <= self.max_bytes and len(self._entries) <= self.max_entries:
+            return
+        for key, (_, size) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes and len(self._entries) <= self.max_entries:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._entries[key]
+            total -= size
+
+    def size_bytes(self):
+        with self._lock:
+            return sum(size for _, size in self._entries.values())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Caché de audio compartido por el proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(TTS_CONFIG["cache_dir"], TTS_CONFIG["cache_max_bytes"],
+                                TTS_CONFIG["cache_max_entries"])
+        return _cache
+
+def synthesize(client, text, voice_id=None, labels=None):
+    """
+    Sintetiza un texto ya limpio y devuelve el MP3 en bytes (usando el caché si está).
+    `labels` (tema y sesión) etiqueta el span cuando corre en el executor.
+    """
+    key = cache_key(text, voice_id)
+    cache = get_cache()
+    audio = cache.get(key)
+    if audio is not None:
+        return audio
+    # El audio se consume dentro de la llamada para que un corte a mitad también se reintente
+    with metrics.span("tts_synthesize", **(labels or {})):
+        audio = upstream.call("elevenlabs", lambda: b"".join(client.text_to_speech.convert(
+            voice_id=voice_id or TTS_CONFIG["voice_id"],
+            model_id=TTS_CONFIG["model_id"],
+            text=text,
+            voice_settings=TTS_CONFIG["voice_settings"],
+        )))
+    try:
+        cache.put(key, audio)
+    except OSError as e:
+        print(f"DEBUG: No se pudo guardar el audio en caché: {e}")
+    return audio
+
+def prewarm(client, texts, clean=None, voice_id=None):
+    """Sintetiza en segundo plano los textos fijos (saludos) que todavía no están en caché."""
+    clean = clean or (lambda text: text)
+    futures = []
+    if not upstream.available("elevenlabs"):
+        return futures
+    labels = metrics.current_context()
+    for text in texts:
+        cleaned = clean(text).strip(" .")
+        if cleaned and get_cache().get(cache_key(cleaned, voice_id)) is None:
+            futures.append(get_executor().submit(synthesize, client, cleaned, voice_id, labels))
+    return futures
+
+def cleanup_leaked_temp_audio(max_age=None):
+    """
+    Borra los MP3 que dejaba NamedTemporaryFile(delete=False) en el directorio temporal
+    en versiones anteriores. Solo toca archivos tmp*.mp3 más viejos que `max_age` segundos.
+    """
+    max_age = TTS_CONFIG["leaked_temp_max_age"] if max_age is None else max_age
+    temp_dir = tempfile.gettempdir()
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(temp_dir):
+        if not (name.startswith("tmp") and name.endswith(".mp3")):
+            continue
+        path = os.path.join(temp_dir, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class SentenceChunker:
+    """Acumula los fragmentos del streaming y entrega trozos que terminan en fin de oración."""
+
+    def __init__(self):
+        self._buffer = ""
+        self._emitted = 0
+
+    def feed(self, delta):
+        self._buffer += delta
+        min_chars = TTS_CONFIG["min_first_chunk_chars"] if self._emitted == 0 else TTS_CONFIG["min_chunk_chars"]
+        if len(self._buffer) < min_chars:
+            return []
+        boundaries = [m.end() for m in SENTENCE_BOUNDARY.finditer(self._buffer) if m.end() >= min_chars]
+        if not boundaries:
+            return []
+        cut = boundaries[-1]
+        chunk, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        self._emitted += 1
+        return [chunk]
+
+    def flush(self):
+        chunk, self._buffer = self._buffer, ""
+        return [chunk] if chunk.strip() else []
+
+
+class SpeechPipeline:
+    """
+    Envía cada oración a sintetizar en cuanto se completa y devuelve los audios en orden.
+
+    `clean` se aplica a cada trozo antes de sintetizarlo (por ejemplo clean_message_for_audio).
+    """
+
+    def __init__(self, client, clean=None, voice_id=None):
+        self._client = client
+        self._clean = clean or (lambda text: text)
+        self._voice_id = voice_id
+        self._labels = metrics.current_context()  # Los spans del executor no ven el contexto del hilo
+        self._chunker = SentenceChunker()
+        self._futures = []
+        self._next = 0
+
+    def _submit(self, chunks):
+        for chunk in chunks:
+            text = self._clean(chunk).strip(" .")
+            if text:
+                self._futures.append(get_executor().submit(synthesize, self._client, text, self._voice_id,
+                                                            self._labels))
+
+    def feed(self, delta):
+        self._submit(self._chunker.feed(delta))
+
+    def close(self):
+        self._submit(self._chunker.flush())
+
+    def ready(self):
+        """Audios listos que siguen en orden al último entregado (no bloquea)."""
+        ready = []
+        while self._next < len(self._futures) and self._futures[self._next].done():
+            ready.append(self._result(self._next))
+            self._next += 1
+        return [audio for audio in ready if audio]
+
+    def remaining(self):
+        """Espera y entrega, en orden, los audios que faltan."""
+        while self._next < len(self._futures):
+            audio = self._result(self._next)
+            self._next += 1
+            if audio:
+                yield audio
+
+    def _result(self, position):
+        try:
+            return self._futures[position].result()
+        except Exception as e:
+            print(f"DEBUG: Error al sintetizar un fragmento de audio: {e}")
+            return None
+
+
+# Reproductor en el navegador: cada fragmento se agrega a una cola que vive en la página,
+# así los fragmentos suenan uno detrás de otro aunque lleguen en iframes distintos.
+AUDIO_QUEUE_SCRIPT = """
+<script>
+(function() {{
+  const w = window.parent;
+  let player = w.__sofiaAudio;
+  if (!player || player.turn !== {turn}) {{
+    if (player && player.current) {{ player.current.pause(); }}
+    player = w.__sofiaAudio = {{turn: {turn}, queue: [], current: null}};
+  }}
+  player.queue.push({src});
+  function playNext() {{
+    if (player.current || !player.queue.length) return;
+    const audio = player.current = new w.Audio(player.queue.shift());
+    // Al terminar, fallar o quedar bloqueado por el navegador, sigue con el próximo fragmento
+    const next = () => {{ if (player.current === audio) {{ player.current = null; playNext(); }} }};
+    audio.onended = next;
+    audio.onerror = next;
+    audio.play().catch(next);
+  }}
+  playNext();
+}})();
+</script>
+"""
+
+def render_audio_chunk(audio_bytes, turn):
+    """Encola un fragmento MP3 en el reproductor de la página (iframe invisible)."""
+    import streamlit.components.v1 as components
+    src = "data:audio/mp3;base64," + base64.b64encode(audio_bytes).decode("ascii")
+    components.html(AUDIO_QUEUE_SCRIPT.format(turn=json.dumps(turn), src=json.dumps(src)), height=0)
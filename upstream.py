@@ -0,0 +1,340 @@
+# upstream.py
+"""
+Planificador compartido por el proceso para las llamadas a OpenAI y ElevenLabs.
+
+Cada proveedor tiene un límite de tasa (token bucket), un tope de llamadas simultáneas,
+reintentos con backoff exponencial y jitter ante 429, 5xx y errores de conexión, y un
+circuit breaker: después de varias fallas seguidas deja de llamar durante un rato y
+`available()` devuelve False, así la app puede degradar (por ejemplo, responder solo con
+texto si el TTS está caído). `stats()` expone la cola, las esperas y el estado del breaker.
+"""
+import time
+import random
+import threading
+from collections import Counter
+
+UPSTREAM_CONFIG = {
+    "openai": {
+        "rate_per_second": 5.0,    # Llamadas nuevas por segundo (promedio)
+        "burst": 10,               # Llamadas que pueden salir juntas
+        "max_concurrency": 16,     # Streams abiertos a la vez
+        "queue_timeout": 20.0,     # Segundos máximos esperando un turno
+        "max_retries": 3,
+        "backoff_base": 0.5,
+        "backoff_max": 8.0,
+        "failure_threshold": 5,    # Fallas seguidas que abren el breaker
+        "reset_timeout": 30.0,     # Segundos con el breaker abierto antes de probar de nuevo
+    },
+    "elevenlabs": {
+        "rate_per_second": 4.0,
+        "burst": 6,
+        "max_concurrency": 6,
+        "queue_timeout": 10.0,
+        "max_retries": 2,
+        "backoff_base": 0.3,
+        "backoff_max": 4.0,
+        "failure_threshold": 3,
+        "reset_timeout": 60.0,
+    },
+}
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class ProviderUnavailable(Exception):
+    """El proveedor no se llamó: breaker abierto o demasiada espera en la cola."""
+
+
+def status_code(error):
+    """Código HTTP de una excepción de los SDK de OpenAI / ElevenLabs / httpx, si lo tiene."""
+    code = getattr(error, "status_code", None)
+    if code is None and getattr(error, "response", None) is not None:
+        code = getattr(error.response, "status_code", None)
+    return code
+
+def is_retryable(error):
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    # Sin código HTTP: errores de red o timeouts del cliente
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name or isinstance(error, (ConnectionError, TimeoutError))
+
+def retry_after(error):
+    """Segundos pedidos por el servidor en Retry-After, si vinieron."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Toma un token y devuelve cuántos segundos hay que esperar para usarlo."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self):
+        """Devuelve el token de una llamada que no llegó a hacerse."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class CircuitBreaker:
+    """Cerrado -> abierto tras `threshold` fallas seguidas -> medio abierto tras `reset_timeout`."""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if now - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """True si se puede llamar. En medio abierto deja pasar una sola llamada de prueba."""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        """La llamada de prueba no llegó a hacerse; otra podrá intentarlo."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class Provider:
+    """Límite de tasa, concurrencia, reintentos y breaker de un proveedor."""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.bucket = TokenBucket(config["rate_per_second"], config["burst"])
+        self.breaker = CircuitBreaker(config["failure_threshold"], config["reset_timeout"])
+        self._slots = threading.BoundedSemaphore(config["max_concurrency"])
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self.counters = Counter()
+
+    def available(self):
+        return self.breaker.state != "open"
+
+    def _acquire(self):
+        if not self.breaker.allow():
+            with self._lock:
+                self.counters["rejected"] += 1
+            raise ProviderUnavailable(f"{self.name}: servicio no disponible momentáneamente")
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            delay = self.bucket.reserve()
+            if delay > self.config["queue_timeout"]:
+                self.bucket.refund()
+                raise ProviderUnavailable(f"{self.name}: demasiadas solicitudes en espera")
+            if delay:
+                time.sleep(delay)
+            remaining = self.config["queue_timeout"] - (time.monotonic() - start)
+            if not self._slots.acquire(timeout=max(remaining, 0)):
+                raise ProviderUnavailable(f"{self.name}: demasiadas solicitudes en espera")
+        except ProviderUnavailable:
+            with self._lock:
+                self.counters["rejected"] += 1
+            self.breaker.cancel_probe()
+            raise
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_flight += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self.counters["calls"] += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt, error):
+        hinted = retry_after(error)
+        if hinted is not None:
+            return min(hinted, self.config["backoff_max"])
+        # "Full jitter": espera aleatoria entre 0 y el backoff exponencial
+        return random.uniform(0, min(self.config["backoff_max"], self.config["backoff_base"] * 2 ** attempt))
+
+    def _run_with_retry(self, fn, args, kwargs):
+        for attempt in range(self.config["max_retries"] + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.config["max_retries"] or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self.counters["retries"] += 1
+                time.sleep(self._backoff(attempt, e))
+
+    def call(self, fn, *args, **kwargs):
+        """Ejecuta `fn` respetando los límites y con reintentos; el resultado se devuelve completo."""
+        self._acquire()
+        try:
+            result = self._run_with_retry(fn, args, kwargs)
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        finally:
+            self._release()
+        self.breaker.record_success()
+        return result
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Como `call`, pero para respuestas en streaming: reintenta al abrir el stream y mantiene
+        ocupado el lugar de concurrencia hasta que se consume o se cierra. El breaker registra
+        el resultado al terminar el stream, no al abrirlo: un proveedor que corta todos los
+        streams a la mitad termina abriéndolo.
+        """
+        self._acquire()
+        try:
+            stream = self._run_with_retry(fn, args, kwargs)
+        except Exception as e:
+            self._release()
+            self._record_failure(e)
+            raise
+        return SlotStream(stream, self._finish_stream)
+
+    def _finish_stream(self, error):
+        """Cierre de un stream: `error` es None si se consumió entero o ABANDONED si se dejó a medias."""
+        if error is None:
+            self.breaker.record_success()
+        elif error is ABANDONED:
+            self.breaker.cancel_probe()  # No se sabe cómo terminaba: otra llamada puede probar
+        else:
+            self._record_failure(error)
+        self._release()
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.counters["failures"] += 1
+        # Los errores del pedido (400, 401...) no indican que el servicio esté caído, pero si
+        # venían de la llamada de prueba hay que liberarla para que otra pueda cerrar el breaker
+        if is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.cancel_probe()
+
+    def stats(self):
+        with self._lock:
+            calls = self.counters["calls"]
+            return {
+                "state": self.breaker.state,
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "avg_wait": (self._wait_total / calls) if calls else 0.0,
+                "max_wait": self._wait_max,
+                **self.counters,
+            }
+
+
+ABANDONED = object()  # Stream cerrado o descartado antes de consumirse entero
+
+
+class SlotStream:
+    """
+    Itera un stream y, al terminar, al cerrarlo o al descartarlo, informa cómo terminó
+    (completo, con error o abandonado) y libera el lugar de concurrencia.
+    """
+
+    def __init__(self, stream, finish):
+        self._stream = stream
+        self._finish = finish
+        self._outcome = ABANDONED
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+            self._outcome = None
+        except Exception as e:
+            self._outcome = e
+            raise
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._finish(self._outcome)
+
+    def __del__(self):
+        self.close()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_provider(name):
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = Provider(name, UPSTREAM_CONFIG[name])
+        return _providers[name]
+
+def call(provider, fn, *args, **kwargs):
+    return get_provider(provider).call(fn, *args, **kwargs)
+
+def stream(provider, fn, *args, **kwargs):
+    return get_provider(provider).stream(fn, *args, **kwargs)
+
+def available(provider):
+    return get_provider(provider).available()
+
+def stats():
+    """Estado de cada proveedor usado hasta ahora (cola, esperas, reintentos y breaker)."""
+    with _providers_lock:
+        providers = dict(_providers)
+    return {name: provider.stats() for name, provider in providers.items()}